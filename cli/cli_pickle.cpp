@@ -28,6 +28,12 @@
 #include <limits.h> // for CHAR_MAX
 #include <getopt.h>
 
+#include <fstream>
+#include <memory>
+#include <sstream>
+#include <string>
+#include <vector>
+
 #include "pickle.hpp"
 
 #include "os_binary.hpp"
@@ -48,11 +54,25 @@ class PickleVisitor : public trace::Visitor
 protected:
     PickleWriter &writer;
     bool symbolic;
+    bool lazyArgs;
+    bool hashCalls;
+
+    // 64-bit FNV-1a
+    static uint64_t hashBytes(const char *data, size_t size) {
+        uint64_t hash = 0xcbf29ce484222325ULL;
+        for (size_t i = 0; i < size; ++i) {
+            hash ^= (unsigned char)data[i];
+            hash *= 0x100000001b3ULL;
+        }
+        return hash;
+    }
 
 public:
-    PickleVisitor(PickleWriter &_writer, bool _symbolic) :
+    PickleVisitor(PickleWriter &_writer, bool _symbolic, bool _lazyArgs = false, bool _hashCalls = false) :
         writer(_writer),
-        symbolic(_symbolic) {
+        symbolic(_symbolic),
+        lazyArgs(_lazyArgs),
+        hashCalls(_hashCalls) {
     }
 
     void visit(Null *node) override {
@@ -172,8 +192,61 @@ public:
 
         writer.writeInt(call->no);
 
+        uint64_t hash = 0;
+        if (hashCalls) {
+            /*
+             * Hash the pickled name, arguments, and return value, so that
+             * consumers can compare calls without walking their arguments.
+             */
+            std::ostringstream ss;
+            PickleWriter bodyWriter(ss);
+            PickleVisitor bodyVisitor(bodyWriter, symbolic, lazyArgs);
+            bodyVisitor.visitBody(call);
+            const std::string & body = ss.str();
+            hash = hashBytes(body.data(), body.size());
+            writer.writeRaw(body.data(), body.size());
+        } else {
+            visitBody(call);
+        }
+
+        writer.writeInt(call->flags);
+
+        if (hashCalls) {
+            writer.writeInt((unsigned long long)hash);
+        }
+
+        writer.endTuple();
+    }
+
+    void visitBody(Call *call) {
         writer.writeString(call->name());
 
+        if (lazyArgs) {
+            /*
+             * Emit the arguments as a self-contained pickle wrapped in a bytes
+             * object, so that the consumer only needs to decode them when
+             * they are actually used.
+             */
+            std::ostringstream ss;
+            PickleWriter argsWriter(ss);
+            PickleVisitor argsVisitor(argsWriter, symbolic);
+            argsWriter.begin();
+            argsVisitor.visitArgs(call);
+            argsWriter.end();
+            const std::string & args = ss.str();
+            writer.writeBytes(args.data(), args.size());
+        } else {
+            visitArgs(call);
+        }
+
+        if (call->ret) {
+            _visit(call->ret);
+        } else {
+            writer.writeNone();
+        }
+    }
+
+    void visitArgs(Call *call) {
         writer.beginList();
         for (unsigned i = 0; i < call->args.size(); ++i) {
             writer.beginTuple(2);
@@ -190,16 +263,105 @@ public:
             writer.endTuple(2);
         }
         writer.endList();
+    }
+};
 
-        if (call->ret) {
-            _visit(call->ret);
-        } else {
-            writer.writeNone();
+
+/*
+ * Writes the calls as a set of flat little-endian arrays, suitable for loading
+ * with numpy.fromfile:
+ *
+ *   PREFIX.no          uint32 call number
+ *   PREFIX.sig         uint32 function signature id
+ *   PREFIX.flags       uint32 call flags
+ *   PREFIX.thread      uint32 thread id
+ *   PREFIX.offsets     uint64 offset of the pickled arguments in PREFIX.args
+ *                      (with an extra trailing entry for the total size)
+ *   PREFIX.args        pickled argument lists, back to back
+ *   PREFIX.functions   function names, one per line, indexed by signature id
+ */
+class ColumnWriter
+{
+protected:
+    std::string prefix;
+    std::ofstream noFile;
+    std::ofstream sigFile;
+    std::ofstream flagsFile;
+    std::ofstream threadFile;
+    std::ofstream offsetsFile;
+    std::ofstream argsFile;
+    PickleWriter argsWriter;
+    PickleVisitor argsVisitor;
+    std::vector<std::string> functionNames;
+
+    void open(std::ofstream &file, const char *suffix) {
+        std::string fileName = prefix + suffix;
+        file.open(fileName, std::ios::out | std::ios::binary | std::ios::trunc);
+        if (!file) {
+            std::cerr << "error: failed to open " << fileName << "\n";
+            exit(1);
         }
+    }
 
-        writer.writeInt(call->flags);
+    static void putUInt32(std::ofstream &file, uint32_t i) {
+        char buf[4];
+        for (unsigned j = 0; j < sizeof buf; ++j) {
+            buf[j] = (i >> (8 * j)) & 0xff;
+        }
+        file.write(buf, sizeof buf);
+    }
 
-        writer.endTuple();
+    static void putUInt64(std::ofstream &file, uint64_t i) {
+        char buf[8];
+        for (unsigned j = 0; j < sizeof buf; ++j) {
+            buf[j] = (i >> (8 * j)) & 0xff;
+        }
+        file.write(buf, sizeof buf);
+    }
+
+public:
+    ColumnWriter(const std::string &_prefix, bool symbolic) :
+        prefix(_prefix),
+        argsWriter(argsFile),
+        argsVisitor(argsWriter, symbolic)
+    {
+        open(noFile, ".no");
+        open(sigFile, ".sig");
+        open(flagsFile, ".flags");
+        open(threadFile, ".thread");
+        open(offsetsFile, ".offsets");
+        open(argsFile, ".args");
+    }
+
+    ~ColumnWriter() {
+        putUInt64(offsetsFile, argsFile.tellp());
+
+        std::ofstream functionsFile;
+        open(functionsFile, ".functions");
+        for (auto &name : functionNames) {
+            functionsFile << name << "\n";
+        }
+    }
+
+    void write(Call *call) {
+        putUInt32(noFile, call->no);
+        putUInt32(sigFile, call->sig->id);
+        putUInt32(flagsFile, call->flags);
+        putUInt32(threadFile, call->thread_id);
+
+        putUInt64(offsetsFile, argsFile.tellp());
+        argsWriter.begin();
+        argsVisitor.visitArgs(call);
+        argsWriter.end();
+
+        if (call->sig->id >= functionNames.size()) {
+            functionNames.resize(call->sig->id + 1);
+        }
+        // The signature names are owned by the parser, so copy them
+        std::string &name = functionNames[call->sig->id];
+        if (name.empty() && call->sig->name) {
+            name = call->sig->name;
+        }
     }
 };
 
@@ -217,12 +379,19 @@ usage(void)
         "\n"
         "    -h, --help           show this help message and exit\n"
         "    -s, --symbolic       dump symbolic names\n"
+        "    --lazy-args          pickle call arguments as nested byte strings\n"
+        "    --columns=PREFIX     also write a columnar call table to PREFIX.*\n"
+        "    --hash               append a 64-bit hash of each call's name, arguments\n"
+        "                         and return value\n"
         "    --calls=CALLSET      only dump specified calls\n"
     ;
 }
 
 enum {
 	CALLS_OPT = CHAR_MAX + 1,
+	LAZY_ARGS_OPT,
+	COLUMNS_OPT,
+	HASH_OPT,
 };
 
 const static char *
@@ -233,6 +402,9 @@ longOptions[] = {
     {"help", no_argument, 0, 'h'},
     {"symbolic", no_argument, 0, 's'},
     {"calls", required_argument, 0, CALLS_OPT},
+    {"lazy-args", no_argument, 0, LAZY_ARGS_OPT},
+    {"columns", required_argument, 0, COLUMNS_OPT},
+    {"hash", no_argument, 0, HASH_OPT},
     {0, 0, 0, 0}
 };
 
@@ -240,6 +412,9 @@ static int
 command(int argc, char *argv[])
 {
     bool symbolic = false;
+    bool lazyArgs = false;
+    const char *columnsPrefix = nullptr;
+    bool hashCalls = false;
 
     int opt;
     while ((opt = getopt_long(argc, argv, shortOptions, longOptions, NULL)) != -1) {
@@ -253,6 +428,15 @@ command(int argc, char *argv[])
         case CALLS_OPT:
             calls.merge(optarg);
             break;
+        case LAZY_ARGS_OPT:
+            lazyArgs = true;
+            break;
+        case COLUMNS_OPT:
+            columnsPrefix = optarg;
+            break;
+        case HASH_OPT:
+            hashCalls = true;
+            break;
         default:
             std::cerr << "error: unexpected option `" << (char)opt << "`\n";
             usage();
@@ -265,7 +449,17 @@ command(int argc, char *argv[])
     std::cout.sync_with_stdio(false);
 
     PickleWriter writer(std::cout);
-    PickleVisitor visitor(writer, symbolic);
+    PickleVisitor visitor(writer, symbolic, lazyArgs, hashCalls);
+
+    std::unique_ptr<ColumnWriter> columnWriter;
+    if (columnsPrefix) {
+        // Signature ids are only unique within a trace file
+        if (argc - optind > 1) {
+            std::cerr << "error: --columns only supports a single trace file\n";
+            return 1;
+        }
+        columnWriter.reset(new ColumnWriter(columnsPrefix, symbolic));
+    }
 
     for (int i = optind; i < argc; ++i) {
         trace::Parser parser;
@@ -280,6 +474,9 @@ command(int argc, char *argv[])
                 writer.begin();
                 visitor.visit(call);
                 writer.end();
+                if (columnWriter) {
+                    columnWriter->write(call);
+                }
             }
             delete call;
         }
@@ -335,6 +335,11 @@ public:
         os.put(1);
     }
 
+    // Write opcodes previously generated by another PickleWriter
+    inline void writeRaw(const char *s, size_t length) {
+        os.write(s, length);
+    }
+
     inline void writePointer(unsigned long long addr) {
         os.put(GLOBAL);
         os << "unpickle\nPointer\n";
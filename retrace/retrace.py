@@ -30,6 +30,7 @@
 # Adjust path
 import os.path
 import sys
+import zlib
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
 
@@ -377,8 +378,9 @@ class Retracer:
     def makeFunctionId(self, function):
         name = function.name
         if function.overloaded:
-            # TODO: Use a sequence number
-            name += '__%08x' % (hash(function) & 0xffffffff)
+            # Derive the suffix from the prototype, so that the generated code
+            # doesn't change from run to run
+            name += '__%08x' % zlib.crc32(function.prototype().encode())
         return name
 
     def retraceFunction(self, function):
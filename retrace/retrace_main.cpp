@@ -69,7 +69,8 @@ static enum {
 static trace::CallSet snapshotFrequency;
 static unsigned snapshotInterval = 0;
 
-static unsigned dumpStateCallNo = ~0;
+static trace::CallSet dumpStateCallSet;
+static bool dumpDefaultState = false;
 
 retrace::Retracer retracer;
 
@@ -328,14 +329,24 @@ retraceCall(trace::Call *call) {
         }
     }
 
-    // dumpStateCallNo is 0 when fetching default state
-    if (call->no == dumpStateCallNo || dumpStateCallNo == 0) {
+    // dumpDefaultState is set when fetching default state
+    if (dumpDefaultState || dumpStateCallSet.contains(*call)) {
         if (dumper->canDump()) {
+            // Multiple states are written as consecutive documents, each
+            // tagged with its call number
             StateWriter *writer = stateWriterFactory(std::cout);
+            if (!dumpDefaultState) {
+                writer->beginMember("call");
+                writer->writeInt(call->no);
+                writer->endMember();
+            }
             dumper->dumpState(*writer);
             delete writer;
-            exit(0);
-        } else if (dumpStateCallNo != 0) {
+            if (dumpDefaultState || call->no >= dumpStateCallSet.getLast()) {
+                exit(0);
+            }
+            std::cout.flush();
+        } else if (!dumpDefaultState) {
             std::cerr << call->no << ": error: failed to dump state\n";
             exit(1);
         }
@@ -718,7 +729,7 @@ usage(const char *argv0) {
         "  -t, --snapshot-threaded encode screenshots on multiple threads\n"
         "      --snapshot-force-backbuffer always read from the backbuffer when taking a snapshot (default read from the current draw buffer)\n"
         "  -v, --verbose           increase output verbosity\n"
-        "  -D, --dump-state=CALL   dump state at specific call no\n"
+        "  -D, --dump-state=CALLSET  dump state at specific call no(s)\n"
         "      --dump-format=FORMAT dump state format (`json` or `ubjson`)\n"
         "      --min-frame-duration=MICROSECONDS   specify minimum frame rendering duration\n"
         "      --per-frame-delay=MICROSECONDS   add extra delay after each frame (in addition to min-frame-duration)\n"
@@ -1068,7 +1079,12 @@ int main(int argc, char **argv)
             useCallNos = trace::boolOption(optarg);
             break;
         case 'D':
-            dumpStateCallNo = atoi(optarg);
+            // 0 means the default state
+            if (strcmp(optarg, "0") == 0) {
+                dumpDefaultState = true;
+            } else {
+                dumpStateCallSet.merge(optarg);
+            }
             dumpingState = true;
             retrace::verbosity = -2;
             break;
@@ -0,0 +1,672 @@
+#!/usr/bin/env python3
+##########################################################################
+#
+# Copyright 2026 The apitrace authors
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+##########################################################################/
+
+
+'''Estimate the GPU memory footprint of the buffers, textures and
+renderbuffers allocated by a trace, frame by frame.
+
+Sizes follow the rules of helpers/glsize.hpp and helpers/dxgisize.hpp, for
+tightly packed storage, so they are a lower bound of what drivers actually
+allocate.'''
+
+
+import csv
+import optparse
+import os.path
+import re
+import sys
+
+import unpickle
+
+
+KINDS = ('buffer', 'texture', 'renderbuffer')
+
+
+##########################################################################
+# OpenGL sizes
+
+
+# Bits per element, as _gl_type_size
+_glTypeBits = {
+    'GL_BYTE': 8,
+    'GL_UNSIGNED_BYTE': 8,
+    'GL_SHORT': 16,
+    'GL_UNSIGNED_SHORT': 16,
+    'GL_HALF_FLOAT': 16,
+    'GL_HALF_FLOAT_OES': 16,
+    'GL_INT': 32,
+    'GL_UNSIGNED_INT': 32,
+    'GL_FLOAT': 32,
+}
+
+# Bits per pixel of packed types, as _gl_format_size
+_glPackedTypeBits = {
+    'GL_BITMAP': 1,
+    'GL_UNSIGNED_BYTE_3_3_2': 8,
+    'GL_UNSIGNED_BYTE_2_3_3_REV': 8,
+    'GL_UNSIGNED_SHORT_4_4_4_4': 16,
+    'GL_UNSIGNED_SHORT_4_4_4_4_REV': 16,
+    'GL_UNSIGNED_SHORT_5_5_5_1': 16,
+    'GL_UNSIGNED_SHORT_1_5_5_5_REV': 16,
+    'GL_UNSIGNED_SHORT_5_6_5': 16,
+    'GL_UNSIGNED_SHORT_5_6_5_REV': 16,
+    'GL_UNSIGNED_SHORT_8_8_MESA': 16,
+    'GL_UNSIGNED_SHORT_8_8_REV_MESA': 16,
+    'GL_UNSIGNED_INT_8_8_8_8': 32,
+    'GL_UNSIGNED_INT_8_8_8_8_REV': 32,
+    'GL_UNSIGNED_INT_10_10_10_2': 32,
+    'GL_UNSIGNED_INT_2_10_10_10_REV': 32,
+    'GL_UNSIGNED_INT_24_8': 32,
+    'GL_UNSIGNED_INT_10F_11F_11F_REV': 32,
+    'GL_UNSIGNED_INT_5_9_9_9_REV': 32,
+    'GL_FLOAT_32_UNSIGNED_INT_24_8_REV': 64,
+}
+
+# Number of channels, as _gl_format_channels
+_glFormatChannels = {}
+for _channels, _formats in [
+    (1, 'COLOR_INDEX RED RED_INTEGER GREEN GREEN_INTEGER BLUE BLUE_INTEGER '
+        'ALPHA ALPHA_INTEGER INTENSITY LUMINANCE LUMINANCE_INTEGER_EXT '
+        'DEPTH_COMPONENT STENCIL_INDEX'),
+    (2, 'DEPTH_STENCIL LUMINANCE_ALPHA LUMINANCE_ALPHA_INTEGER_EXT RG RG_INTEGER'),
+    (3, 'RGB RGB_INTEGER BGR BGR_INTEGER'),
+    (4, 'RGBA RGBA_INTEGER BGRA BGRA_INTEGER ABGR_EXT'),
+]:
+    for _format in _formats.split():
+        _glFormatChannels['GL_' + _format] = _channels
+
+# Legacy unsized internal formats
+_glFormatChannels.update({1: 1, 2: 2, 3: 3, 4: 4})
+
+
+def _glFormatBits(format, type):
+    '''Bits per pixel for client format/type pair, as _gl_format_size.'''
+    try:
+        return _glPackedTypeBits[type]
+    except KeyError:
+        pass
+    return _glFormatChannels.get(format, 0) * _glTypeBits.get(type, 0)
+
+
+# Blocks of internal formats, as (width, height, bits) tuples
+_glInternalFormatBlocks = {}
+for _prefix, _channels in (('R', 1), ('RG', 2), ('RGB', 3), ('RGBA', 4)):
+    for _bits in (8, 16, 32):
+        for _suffix in ('', '_SNORM', 'F', 'I', 'UI'):
+            _glInternalFormatBlocks['GL_%s%u%s' % (_prefix, _bits, _suffix)] = (1, 1, _channels * _bits)
+for _bits, _formats in [
+    (8, 'R3_G3_B2 ALPHA8 LUMINANCE8 INTENSITY8 STENCIL_INDEX8'),
+    (16, 'RGB4 RGB5 RGB565 RGBA4 RGB5_A1 LUMINANCE8_ALPHA8 ALPHA16 '
+         'LUMINANCE16 INTENSITY16 DEPTH_COMPONENT16'),
+    (24, 'SRGB8'),
+    (32, 'RGB10 RGB10_A2 RGB10_A2UI R11F_G11F_B10F RGB9_E5 SRGB8_ALPHA8 '
+         'BGRA8_EXT DEPTH_COMPONENT24 DEPTH_COMPONENT32 DEPTH_COMPONENT32F '
+         'DEPTH24_STENCIL8'),
+    (64, 'RGBA12 DEPTH32F_STENCIL8'),
+]:
+    for _format in _formats.split():
+        _glInternalFormatBlocks['GL_' + _format] = (1, 1, _bits)
+for _bits, _formats in [
+    (64, 'COMPRESSED_RGB_S3TC_DXT1_EXT COMPRESSED_RGBA_S3TC_DXT1_EXT '
+         'COMPRESSED_SRGB_S3TC_DXT1_EXT COMPRESSED_SRGB_ALPHA_S3TC_DXT1_EXT '
+         'COMPRESSED_RED_RGTC1 COMPRESSED_SIGNED_RED_RGTC1 '
+         'ETC1_RGB8_OES COMPRESSED_RGB8_ETC2 COMPRESSED_SRGB8_ETC2 '
+         'COMPRESSED_RGB8_PUNCHTHROUGH_ALPHA1_ETC2 '
+         'COMPRESSED_SRGB8_PUNCHTHROUGH_ALPHA1_ETC2 '
+         'COMPRESSED_R11_EAC COMPRESSED_SIGNED_R11_EAC'),
+    (128, 'COMPRESSED_RGBA_S3TC_DXT3_EXT COMPRESSED_RGBA_S3TC_DXT5_EXT '
+          'COMPRESSED_SRGB_ALPHA_S3TC_DXT3_EXT COMPRESSED_SRGB_ALPHA_S3TC_DXT5_EXT '
+          'COMPRESSED_RG_RGTC2 COMPRESSED_SIGNED_RG_RGTC2 '
+          'COMPRESSED_RGBA_BPTC_UNORM COMPRESSED_SRGB_ALPHA_BPTC_UNORM '
+          'COMPRESSED_RGB_BPTC_SIGNED_FLOAT COMPRESSED_RGB_BPTC_UNSIGNED_FLOAT '
+          'COMPRESSED_RGBA8_ETC2_EAC COMPRESSED_SRGB8_ALPHA8_ETC2_EAC '
+          'COMPRESSED_RG11_EAC COMPRESSED_SIGNED_RG11_EAC'),
+]:
+    for _format in _formats.split():
+        _glInternalFormatBlocks['GL_' + _format] = (4, 4, _bits)
+
+_astcRegExp = re.compile(r'^GL_COMPRESSED_(?:RGBA|SRGB8_ALPHA8)_ASTC_(\d+)x(\d+)_KHR$')
+
+_unknownFormats = set()
+
+
+def _glInternalFormatBlock(internalformat):
+    try:
+        return _glInternalFormatBlocks[internalformat]
+    except KeyError:
+        pass
+    if isinstance(internalformat, str):
+        mo = _astcRegExp.match(internalformat)
+        if mo:
+            return int(mo.group(1)), int(mo.group(2)), 128
+    channels = _glFormatChannels.get(internalformat)
+    if channels is not None:
+        # Unsized, assume 8 bits per channel
+        return 1, 1, channels * 8
+    if internalformat not in _unknownFormats:
+        _unknownFormats.add(internalformat)
+        sys.stderr.write('warning: unknown internal format %s\n' % (internalformat,))
+    return 1, 1, 0
+
+
+_cubeFaceRegExp = re.compile(r'^GL_TEXTURE_CUBE_MAP_(POSITIVE|NEGATIVE)_[XYZ]')
+
+_glArrayTargets = {
+    'GL_TEXTURE_1D_ARRAY': 2,
+    'GL_TEXTURE_2D_ARRAY': 3,
+    'GL_TEXTURE_CUBE_MAP_ARRAY': 3,
+    'GL_TEXTURE_2D_MULTISAMPLE_ARRAY': 3,
+}
+
+
+def _glBindingTarget(target):
+    if isinstance(target, str) and _cubeFaceRegExp.match(target):
+        return 'GL_TEXTURE_CUBE_MAP'
+    return target
+
+
+##########################################################################
+# DXGI sizes
+
+
+# Blocks of DXGI formats, as (width, height, bits) tuples, as _calcDataSize
+_dxgiFormatBlocks = {}
+for _block, _formats in [
+    ((1, 1, 128), 'R32G32B32A32_TYPELESS R32G32B32A32_FLOAT R32G32B32A32_UINT '
+                  'R32G32B32A32_SINT'),
+    ((1, 1, 96), 'R32G32B32_TYPELESS R32G32B32_FLOAT R32G32B32_UINT R32G32B32_SINT'),
+    ((1, 1, 64), 'R16G16B16A16_TYPELESS R16G16B16A16_FLOAT R16G16B16A16_UNORM '
+                 'R16G16B16A16_UINT R16G16B16A16_SNORM R16G16B16A16_SINT '
+                 'R32G32_TYPELESS R32G32_FLOAT R32G32_UINT R32G32_SINT '
+                 'R32G8X24_TYPELESS D32_FLOAT_S8X24_UINT R32_FLOAT_X8X24_TYPELESS '
+                 'X32_TYPELESS_G8X24_UINT'),
+    ((1, 1, 32), 'R10G10B10A2_TYPELESS R10G10B10A2_UNORM R10G10B10A2_UINT '
+                 'R11G11B10_FLOAT R8G8B8A8_TYPELESS R8G8B8A8_UNORM '
+                 'R8G8B8A8_UNORM_SRGB R8G8B8A8_UINT R8G8B8A8_SNORM R8G8B8A8_SINT '
+                 'R16G16_TYPELESS R16G16_FLOAT R16G16_UNORM R16G16_UINT '
+                 'R16G16_SNORM R16G16_SINT R32_TYPELESS D32_FLOAT R32_FLOAT '
+                 'R32_UINT R32_SINT R24G8_TYPELESS D24_UNORM_S8_UINT '
+                 'R24_UNORM_X8_TYPELESS X24_TYPELESS_G8_UINT R9G9B9E5_SHAREDEXP '
+                 'B8G8R8A8_UNORM B8G8R8X8_UNORM R10G10B10_XR_BIAS_A2_UNORM '
+                 'B8G8R8A8_TYPELESS B8G8R8A8_UNORM_SRGB B8G8R8X8_TYPELESS '
+                 'B8G8R8X8_UNORM_SRGB AYUV'),
+    ((1, 1, 16), 'R8G8_TYPELESS R8G8_UNORM R8G8_UINT R8G8_SNORM R8G8_SINT '
+                 'R16_TYPELESS R16_FLOAT D16_UNORM R16_UNORM R16_UINT R16_SNORM '
+                 'R16_SINT B5G6R5_UNORM B5G5R5A1_UNORM B4G4R4A4_UNORM A8P8'),
+    ((1, 1, 8), 'R8_TYPELESS R8_UNORM R8_UINT R8_SNORM R8_SINT A8_UNORM P8'),
+    ((1, 1, 1), 'R1_UNORM'),
+    ((2, 1, 32), 'R8G8_B8G8_UNORM G8R8_G8B8_UNORM YUY2'),
+    ((4, 4, 64), 'BC1_TYPELESS BC1_UNORM BC1_UNORM_SRGB BC4_TYPELESS BC4_UNORM '
+                 'BC4_SNORM'),
+    ((4, 4, 128), 'BC2_TYPELESS BC2_UNORM BC2_UNORM_SRGB BC3_TYPELESS BC3_UNORM '
+                  'BC3_UNORM_SRGB BC5_TYPELESS BC5_UNORM BC5_SNORM BC6H_TYPELESS '
+                  'BC6H_UF16 BC6H_SF16 BC7_TYPELESS BC7_UNORM BC7_UNORM_SRGB'),
+]:
+    for _format in _formats.split():
+        _dxgiFormatBlocks['DXGI_FORMAT_' + _format] = _block
+
+
+def _dxgiFormatBlock(format):
+    try:
+        return _dxgiFormatBlocks[format]
+    except KeyError:
+        pass
+    if format not in _unknownFormats:
+        _unknownFormats.add(format)
+        sys.stderr.write('warning: unknown DXGI format %s\n' % (format,))
+    return 1, 1, 0
+
+
+def _getNumMipLevels(width, height=1, depth=1):
+    mipLevels = 0
+    while True:
+        mipLevels += 1
+        width >>= 1
+        height >>= 1
+        depth >>= 1
+        if not (width or height or depth):
+            return mipLevels
+
+
+##########################################################################
+
+
+def _imageSize(block, width, height=1, depth=1):
+    blockWidth, blockHeight, blockBits = block
+    width = (width + blockWidth - 1) // blockWidth
+    height = (height + blockHeight - 1) // blockHeight
+    return (width * blockBits + 7) // 8 * height * depth
+
+
+def _mipChainSize(block, levels, width, height=1, depth=1, layers=1):
+    '''Size of all levels of a mipmapped image, with layers not being
+    minified.'''
+    size = 0
+    for level in range(levels):
+        size += _imageSize(block,
+                           max(width >> level, 1),
+                           max(height >> level, 1),
+                           max(depth >> level, 1))
+    return size * layers
+
+
+def _deref(value):
+    '''Pointers to single values are pickled as one element lists.'''
+    if isinstance(value, (list, tuple)):
+        if not value:
+            return None
+        return value[0]
+    return value
+
+
+_glDeleters = {
+    'glDeleteBuffers': 'buffer',
+    'glDeleteBuffersARB': 'buffer',
+    'glDeleteTextures': 'texture',
+    'glDeleteTexturesEXT': 'texture',
+    'glDeleteRenderbuffers': 'renderbuffer',
+    'glDeleteRenderbuffersEXT': 'renderbuffer',
+    'glDeleteRenderbuffersOES': 'renderbuffer',
+}
+
+_bufferDataRegExp = re.compile(r'^gl(Named)?Buffer(Data|Storage)(ARB|EXT)?$')
+_texStorageRegExp = re.compile(r'^gl(Tex|Texture)Storage([123])D(Multisample)?(EXT)?$')
+_texImageRegExp = re.compile(r'^gl(Tex|Texture)Image([123])D(Multisample)?(EXT)?$')
+_compressedTexImageRegExp = re.compile(r'^glCompressed(Tex|Texture)Image([123])D(ARB|EXT)?$')
+_renderbufferStorageRegExp = re.compile(r'^gl(Named)?RenderbufferStorage(Multisample)?(EXT|OES)?$')
+
+
+class Frame:
+
+    def __init__(self, no, callNo, kindSizes, total, peak, peakCallNo):
+        self.no = no
+        self.callNo = callNo
+        self.kindSizes = kindSizes
+        self.total = total
+        self.peak = peak
+        self.peakCallNo = peakCallNo
+
+
+class FootprintTracker(unpickle.Unpickler):
+    '''Track the size of every live resource, and sample the totals by kind at
+    the end of every frame.'''
+
+    def __init__(self, stream):
+        unpickle.Unpickler.__init__(self, stream)
+
+        # {(kind, name): {subresource: size}}
+        self.objects = {}
+
+        self.kindSizes = dict.fromkeys(KINDS, 0)
+        self.total = 0
+
+        # High-water marks, as [size, callNo] lists
+        self.kindPeaks = dict((kind, [0, None]) for kind in KINDS)
+        self.peak = [0, None]
+
+        self.frames = []
+        self.framePeak = [0, None]
+        self.lastCallNo = None
+
+        # GL binding state
+        self.activeTexture = 'GL_TEXTURE0'
+        self.bindings = {}
+        self.textureTargets = {}
+
+        # Live D3D resources, {pointer: kind}
+        self.d3dObjects = {}
+
+        # Handler of every function name, looked up once
+        self.handlers = {}
+
+    def parse(self):
+        unpickle.Unpickler.parse(self)
+
+        # Calls after the last frame end
+        if self.lastCallNo is not None and \
+           (not self.frames or self.frames[-1].callNo != self.lastCallNo):
+            self.endFrame(self.lastCallNo)
+
+    def handleCall(self, call):
+        self.lastCallNo = call.no
+
+        if not call.flags & unpickle.CALL_FLAG_NO_SIDE_EFFECTS:
+            try:
+                handler = self.handlers[call.functionName]
+            except KeyError:
+                handler = self.lookupHandler(call.functionName)
+                self.handlers[call.functionName] = handler
+            if handler is not None:
+                handler(call, dict(call.args))
+
+        if call.flags & unpickle.CALL_FLAG_END_FRAME:
+            self.endFrame(call.no)
+
+    def lookupHandler(self, name):
+        if name in _glDeleters:
+            return self.handleDelete
+        if name in ('glBindBuffer', 'glBindBufferARB', 'glBindBufferBase', 'glBindBufferRange'):
+            return self.handleBindBuffer
+        if name in ('glBindTexture', 'glBindTextureEXT'):
+            return self.handleBindTexture
+        if name in ('glActiveTexture', 'glActiveTextureARB'):
+            return self.handleActiveTexture
+        if name in ('glBindRenderbuffer', 'glBindRenderbufferEXT', 'glBindRenderbufferOES'):
+            return self.handleBindRenderbuffer
+        if name == 'glCreateTextures':
+            return self.handleCreateTextures
+        if _bufferDataRegExp.match(name):
+            return self.handleBufferData
+        if _texStorageRegExp.match(name):
+            return self.handleTexStorage
+        if _texImageRegExp.match(name):
+            return self.handleTexImage
+        if _compressedTexImageRegExp.match(name):
+            return self.handleCompressedTexImage
+        if _renderbufferStorageRegExp.match(name):
+            return self.handleRenderbufferStorage
+
+        interface, sep, method = name.partition('::')
+        if sep:
+            if method == 'CreateBuffer':
+                return self.handleCreateBuffer
+            if method in ('CreateTexture1D', 'CreateTexture2D', 'CreateTexture2D1',
+                          'CreateTexture3D', 'CreateTexture3D1'):
+                return self.handleCreateTexture
+            if method == 'Release':
+                return self.handleRelease
+
+        return None
+
+    # Accounting
+
+    def setSize(self, kind, name, subresource, size, callNo):
+        subresources = self.objects.setdefault((kind, name), {})
+        delta = size - subresources.get(subresource, 0)
+        subresources[subresource] = size
+        self.account(kind, delta, callNo)
+
+    def setSizes(self, kind, name, subresources, callNo):
+        delta = sum(subresources.values())
+        oldSubresources = self.objects.get((kind, name))
+        if oldSubresources is not None:
+            delta -= sum(oldSubresources.values())
+        self.objects[(kind, name)] = subresources
+        self.account(kind, delta, callNo)
+
+    def free(self, kind, name, callNo):
+        subresources = self.objects.pop((kind, name), None)
+        if subresources is not None:
+            self.account(kind, -sum(subresources.values()), callNo)
+
+    def account(self, kind, delta, callNo):
+        if not delta:
+            return
+        self.kindSizes[kind] += delta
+        self.total += delta
+        kindPeak = self.kindPeaks[kind]
+        if self.kindSizes[kind] > kindPeak[0]:
+            kindPeak[:] = self.kindSizes[kind], callNo
+        if self.total > self.peak[0]:
+            self.peak[:] = self.total, callNo
+        if self.total > self.framePeak[0]:
+            self.framePeak[:] = self.total, callNo
+
+    def endFrame(self, callNo):
+        peak, peakCallNo = self.framePeak
+        self.frames.append(Frame(len(self.frames), callNo, dict(self.kindSizes), self.total, peak, peakCallNo))
+        self.framePeak = [self.total, callNo]
+
+    # OpenGL
+
+    def handleDelete(self, call, args):
+        kind = _glDeleters[call.functionName]
+        names = call.argValues()[1]
+        for name in names or []:
+            self.free(kind, name, call.no)
+
+    def handleBindBuffer(self, call, args):
+        self.bindings[args['target']] = args['buffer']
+
+    def handleActiveTexture(self, call, args):
+        self.activeTexture = args['texture']
+
+    def handleBindTexture(self, call, args):
+        target = args['target']
+        texture = args['texture']
+        self.bindings[(self.activeTexture, target)] = texture
+        self.textureTargets.setdefault(texture, target)
+
+    def handleCreateTextures(self, call, args):
+        for texture in args['textures'] or []:
+            self.textureTargets[texture] = args['target']
+
+    def handleBindRenderbuffer(self, call, args):
+        self.bindings['GL_RENDERBUFFER'] = args['renderbuffer']
+
+    def getTexture(self, args):
+        '''Return the texture and target an image call refers to.'''
+        target = args.get('target')
+        try:
+            texture = args['texture']
+        except KeyError:
+            texture = self.bindings.get((self.activeTexture, _glBindingTarget(target)), 0)
+        if target is None:
+            target = self.textureTargets.get(texture)
+        return texture, target
+
+    def handleBufferData(self, call, args):
+        try:
+            buffer = args['buffer']
+        except KeyError:
+            buffer = self.bindings.get(args['target'], 0)
+        self.setSizes('buffer', buffer, {None: args['size']}, call.no)
+
+    def handleTexStorage(self, call, args):
+        texture, target = self.getTexture(args)
+        if isinstance(target, str) and target.startswith('GL_PROXY_'):
+            return
+        block = _glInternalFormatBlock(args['internalformat'])
+        dimensions = int(_texStorageRegExp.match(call.functionName).group(2))
+        width = args['width']
+        height = args.get('height', 1)
+        depth = args.get('depth', 1)
+        layers = 1
+        if dimensions == _glArrayTargets.get(target):
+            if dimensions == 2:
+                height, layers = 1, height
+            else:
+                depth, layers = 1, depth
+        elif target == 'GL_TEXTURE_CUBE_MAP':
+            layers = 6
+        if 'samples' in args:
+            levels = 1
+            layers *= max(args['samples'], 1)
+        else:
+            levels = args['levels']
+        size = _mipChainSize(block, levels, width, height, depth, layers)
+        self.setSizes('texture', texture, {None: size}, call.no)
+
+    def handleTexImage(self, call, args):
+        texture, target = self.getTexture(args)
+        if isinstance(target, str) and target.startswith('GL_PROXY_'):
+            return
+        width = args['width']
+        height = args.get('height', 1)
+        depth = args.get('depth', 1)
+        if 'samples' in args:
+            block = _glInternalFormatBlock(args['internalformat'])
+            size = _imageSize(block, width, height, depth) * max(args['samples'], 1)
+            level = 0
+        else:
+            bits = _glFormatBits(args['format'], args['type'])
+            size = (width * bits + 7) // 8 * height * depth
+            level = args['level']
+        self.setSize('texture', texture, (target, level), size, call.no)
+
+    def handleCompressedTexImage(self, call, args):
+        texture, target = self.getTexture(args)
+        if isinstance(target, str) and target.startswith('GL_PROXY_'):
+            return
+        self.setSize('texture', texture, (target, args['level']), args['imageSize'], call.no)
+
+    def handleRenderbufferStorage(self, call, args):
+        try:
+            renderbuffer = args['renderbuffer']
+        except KeyError:
+            renderbuffer = self.bindings.get('GL_RENDERBUFFER', 0)
+        block = _glInternalFormatBlock(args['internalformat'])
+        size = _imageSize(block, args['width'], args['height']) * max(args.get('samples', 1), 1)
+        self.setSizes('renderbuffer', renderbuffer, {None: size}, call.no)
+
+    # Direct3D 10/11
+
+    def addResource(self, call, kind, size):
+        if unpickle.failed(call.ret):
+            return
+        # The created object is the last argument
+        name = _deref(call.argValues()[-1])
+        if not name:
+            return
+        self.d3dObjects[name] = kind
+        self.setSizes(kind, name, {None: size}, call.no)
+
+    def handleCreateBuffer(self, call, args):
+        desc = _deref(call.argValues()[1])
+        if desc is None:
+            return
+        self.addResource(call, 'buffer', desc['ByteWidth'])
+
+    def handleCreateTexture(self, call, args):
+        desc = _deref(call.argValues()[1])
+        if desc is None:
+            return
+        block = _dxgiFormatBlock(desc['Format'])
+        width = desc['Width']
+        height = desc.get('Height', 1)
+        depth = desc.get('Depth', 1)
+        mipLevels = desc['MipLevels'] or _getNumMipLevels(width, height, depth)
+        layers = desc.get('ArraySize', 1)
+        sampleDesc = desc.get('SampleDesc')
+        if sampleDesc is not None:
+            layers *= max(sampleDesc['Count'], 1)
+        size = _mipChainSize(block, mipLevels, width, height, depth, layers)
+        self.addResource(call, 'texture', size)
+
+    def handleRelease(self, call, args):
+        if call.ret != 0:
+            return
+        name = call.argValues()[0]
+        kind = self.d3dObjects.pop(name, None)
+        if kind is not None:
+            self.free(kind, name, call.no)
+
+
+def _mib(size):
+    return '%.2f' % (size / (1024.0 * 1024.0))
+
+
+def _callNo(callNo):
+    return '' if callNo is None else str(callNo)
+
+
+def report(tracker):
+    titles = ['Frame', 'Call'] + \
+             ['%s [MiB]' % kind.capitalize() for kind in KINDS] + \
+             ['Total [MiB]', 'Peak [MiB]', 'Peak [call]']
+    widths = [max(len(title), 10) for title in titles]
+
+    separator = '+-' + '-+-'.join(['-' * width for width in widths]) + '-+'
+    print(separator)
+    print('| ' + ' | '.join([title.center(width) for title, width in zip(titles, widths)]) + ' |')
+    print(separator)
+    for frame in tracker.frames:
+        values = [str(frame.no), str(frame.callNo)] + \
+                 [_mib(frame.kindSizes[kind]) for kind in KINDS] + \
+                 [_mib(frame.total), _mib(frame.peak), _callNo(frame.peakCallNo)]
+        print('| ' + ' | '.join([value.rjust(width) for value, width in zip(values, widths)]) + ' |')
+    print(separator)
+
+    for kind in KINDS:
+        size, callNo = tracker.kindPeaks[kind]
+        if callNo is not None:
+            print('%s high-water mark: %u bytes at call %u' % (kind, size, callNo))
+    size, callNo = tracker.peak
+    if callNo is not None:
+        print('total high-water mark: %u bytes at call %u' % (size, callNo))
+
+
+def writeCsv(stream, tracker):
+    writer = csv.writer(stream)
+    writer.writerow(['frame', 'call'] + list(KINDS) + ['total', 'peak', 'peak_call'])
+    for frame in tracker.frames:
+        writer.writerow([frame.no, frame.callNo] +
+                        [frame.kindSizes[kind] for kind in KINDS] +
+                        [frame.total, frame.peak, _callNo(frame.peakCallNo)])
+
+
+def main():
+    '''Main program.
+    '''
+
+    # Parse command line options
+    optparser = optparse.OptionParser(
+        usage='\n\t%prog [options] TRACE',
+        version='%%prog')
+    optparser.add_option(
+        '-a', '--apitrace', metavar='PROGRAM',
+        type='string', dest='apitrace', default='apitrace',
+        help='apitrace command [default: %default]')
+    optparser.add_option(
+        '--csv', metavar='FILE',
+        type="string", dest="csv", default=None,
+        help="also write the table as CSV to FILE (- for stdout)")
+    unpickle.addCacheOptions(optparser)
+
+    options, args = optparser.parse_args(sys.argv[1:])
+    if len(args) != 1:
+        optparser.error("incorrect number of arguments")
+
+    inTrace = args[0]
+    if not os.path.isfile(inTrace):
+        sys.stderr.write("error: `%s` does not exist\n" % inTrace)
+        sys.exit(1)
+
+    stream = unpickle.openTrace(options.apitrace, inTrace, ['--symbolic', '--lazy-args'], unpickle.getCache(options))
+    tracker = FootprintTracker(stream)
+    tracker.parse()
+
+    report(tracker)
+
+    if options.csv == '-':
+        writeCsv(sys.stdout, tracker)
+    elif options.csv:
+        with open(options.csv, 'wt', newline='') as stream:
+            writeCsv(stream, tracker)
+
+
+if __name__ == '__main__':
+    main()
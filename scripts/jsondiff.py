@@ -26,12 +26,17 @@
 ##########################################################################/
 
 
+import codecs
 import json
+import json.scanner
 import optparse
 import re
 import difflib
+import hashlib
 import sys
 
+import ubjson
+
 
 def strip_object_hook(obj):
     if '__class__' in obj:
@@ -42,6 +47,75 @@ def strip_object_hook(obj):
     return obj
 
 
+class Object(dict):
+    '''JSON object, annotated with the digest of its contents.'''
+
+    __slots__ = ['digest']
+
+
+class Array(list):
+    '''JSON array, annotated with the digest of its contents.'''
+
+    __slots__ = ['digest']
+
+
+def _digestKey(value):
+    '''Stand-in for a value in the digest of its parent.'''
+    t = type(value)
+    if t is Object or t is Array:
+        return value.digest
+    if t is memoryview:
+        return hashlib.blake2b(value, digest_size=16).digest()
+    return value
+
+
+def _digest(values):
+    # repr is unambiguous for the JSON types.  Equal digests imply equal
+    # values, but not the converse (e.g., 1 vs 1.0, or member order), which
+    # is fine as unequal digests merely mean comparing the values.
+    return hashlib.blake2b(repr(values).encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+
+def digestObject(obj):
+    obj.digest = _digest([(name, _digestKey(value)) for name, value in obj.items()])
+    return obj
+
+
+def digestArray(array):
+    array.digest = _digest([_digestKey(value) for value in array])
+    return array
+
+
+def _digest_pairs_hook(pairs):
+    return digestObject(Object(pairs))
+
+
+def _strip_digest_pairs_hook(pairs):
+    obj = Object()
+    for name, value in pairs:
+        if name.startswith('__') and name.endswith('__'):
+            if name == '__class__':
+                return None
+        else:
+            obj[name] = value
+    return digestObject(obj)
+
+
+def hashTree(node):
+    '''Convert a loaded tree into Objects and Arrays annotated with the
+    digests of their subtrees.'''
+
+    if isinstance(node, dict):
+        obj = Object()
+        for name, value in node.items():
+            obj[name] = hashTree(value)
+        return digestObject(obj)
+    elif isinstance(node, list):
+        return digestArray(Array([hashTree(value) for value in node]))
+    else:
+        return node
+
+
 class Visitor:
 
     def visit(self, node, *args, **kwargs):
@@ -133,6 +207,9 @@ class Dumper(Visitor):
         self._write(']')
 
     def visitValue(self, node):
+        if isinstance(node, memoryview):
+            self._write('<%u bytes>' % node.nbytes)
+            return
         self._write(json.dumps(node, allow_nan=True))
 
 
@@ -143,6 +220,14 @@ class Comparer(Visitor):
         self.ignore_added = ignore_added
         self.tolerance = tolerance
 
+    def visit(self, a, b):
+        # Identical subtrees have identical digests, so they need not be
+        # walked.  Other subtrees may still match within the tolerance.
+        t = type(a)
+        if (t is Object or t is Array) and type(b) is t and a.digest == b.digest:
+            return True
+        return Visitor.visit(self, a, b)
+
     def visitObject(self, a, b):
         if not isinstance(b, dict):
             return False
@@ -292,44 +377,263 @@ class Differ(Visitor):
 # useful feature to have on regressions tests
 #
 
-_token_res = [
-    r'//[^\r\n]*', # comment
-    r'"[^"\\]*(\\.[^"\\]*)*"', # string
-]
+_ws_re = re.compile(r'[ \t\r\n]*')
+_ws_comments_re = re.compile(r'(?:[ \t\r\n]+|//[^\r\n]*[\r\n])*')
+_number_re = re.compile(r'(-?(?:0|[1-9][0-9]*))(\.[0-9]+)?([eE][-+]?[0-9]+)?')
+_skip_string_re = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*')
 
-_tokens_re = re.compile(r'|'.join(['(' + token_re + ')' for token_re in _token_res]), re.DOTALL)
+_constants = {
+    'true': True,
+    'false': False,
+    'null': None,
+    'NaN': float('nan'),
+    'Infinity': float('inf'),
+    '-Infinity': float('-inf'),
+}
 
 
-def _strip_comment(mo):
-    if mo.group(1):
-        return ''
-    else:
-        return mo.group(0)
+class Loader:
+    '''Incremental JSON loader.
 
+    The stream is read in chunks and tokenized once.  (Non-standard) comments
+    are skipped as they are read, and when stripping images, objects with a
+    __class__ member and __dunder__ members (such as the __data__ of images)
+    are scanned without being built, so memory use is proportional to the
+    retained state rather than to the size of the dump.
 
-def _strip_comments(data):
-    '''Strip (non-standard) JSON comments.'''
-    return _tokens_re.sub(_strip_comment, data)
+    Containers which are complete within the current chunk, and have no
+    comments, are parsed with the json module's scanner instead.
 
+    With digests, objects and arrays are loaded as Objects and Arrays, so that
+    Comparer can skip identical subtrees.
+    '''
 
-assert _strip_comments('''// a comment
-"// a comment in a string
-"''') == '''
-"// a comment in a string
-"'''
+    chunkSize = 1 << 20
 
+    def __init__(self, stream, strip_images = True, strip_comments = True, digests = False):
+        self.stream = stream
+        self.strip_images = strip_images
+        self.digests = digests
+        if digests:
+            self.Object = Object
+            self.Array = Array
+        else:
+            self.Object = dict
+            self.Array = list
+        if strip_comments:
+            self.ws_re = _ws_comments_re
+        else:
+            self.ws_re = _ws_re
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        if digests:
+            # Arrays parsed by the scanner are plain lists, whose contents
+            # are included in the digest of the parent instead
+            if strip_images:
+                context = json.JSONDecoder(strict=False, object_pairs_hook = _strip_digest_pairs_hook)
+            else:
+                context = json.JSONDecoder(strict=False, object_pairs_hook = _digest_pairs_hook)
+        else:
+            if strip_images:
+                object_hook = strip_object_hook
+            else:
+                object_hook = None
+            context = json.JSONDecoder(strict=False, object_hook = object_hook)
+        self.scan = json.scanner.make_scanner(context)
 
-def load(stream, strip_images = True, strip_comments = True):
-    if strip_images:
-        object_hook = strip_object_hook
-    else:
-        object_hook = None
-    if strip_comments:
-        data = stream.read()
-        data = _strip_comments(data)
-        return json.loads(data, strict=False, object_hook = object_hook)
-    else:
-        return json.load(stream, strict=False, object_hook = object_hook)
+    def _fill(self):
+        '''Read another chunk, discarding what was consumed already.'''
+        if self.eof:
+            return False
+        while True:
+            data = self.stream.read(self.chunkSize)
+            if not isinstance(data, bytes):
+                break
+            text = self.decoder.decode(data, not data)
+            # A partial multi-byte character decodes to nothing
+            if text or not data:
+                data = text
+                break
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        '''Skip whitespace and comments, and return the next character.'''
+        while True:
+            self.pos = self.ws_re.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf) and self.buf[self.pos] != '/':
+                return self.buf[self.pos]
+            if not self._fill():
+                if self.buf.startswith('//', self.pos):
+                    # Unterminated comment at the end
+                    self.pos = len(self.buf)
+                if self.pos < len(self.buf):
+                    return self.buf[self.pos]
+                return ''
+
+    def _expect(self, c):
+        if self._peek() != c:
+            self._error('expecting %r' % c)
+        self.pos += 1
+
+    def _error(self, msg):
+        raise ValueError('%s at %r' % (msg, self.buf[self.pos:self.pos + 32]))
+
+    def _readString(self):
+        while True:
+            try:
+                value, end = json.decoder.scanstring(self.buf, self.pos + 1, False)
+            except ValueError:
+                if self._fill():
+                    continue
+                raise
+            self.pos = end
+            return value
+
+    def _skipString(self):
+        self.pos += 1
+        while True:
+            self.pos = _skip_string_re.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf) and self.buf[self.pos] == '"':
+                self.pos += 1
+                return
+            # Either the end of the chunk, or a backslash at its end
+            if not self._fill():
+                self._error('unterminated string')
+
+    def _readNumber(self):
+        while True:
+            mo = _number_re.match(self.buf, self.pos)
+            if mo is None:
+                if len(self.buf) - self.pos < 2 and self._fill():
+                    continue
+                return self._readConstant()
+            # A fraction or exponent may continue in the next chunk
+            if len(self.buf) - mo.end() < 3 and self._fill():
+                continue
+            self.pos = mo.end()
+            integer, frac, exp = mo.groups()
+            if frac or exp:
+                return float(mo.group(0))
+            else:
+                return int(integer)
+
+    def _readConstant(self):
+        for name, value in _constants.items():
+            while len(self.buf) - self.pos < len(name) and self._fill():
+                pass
+            if self.buf.startswith(name, self.pos):
+                self.pos += len(name)
+                return value
+        self._error('expecting value')
+
+    def _readValue(self, keep = True):
+        c = self._peek()
+        if keep and (c == '{' or c == '['):
+            try:
+                value, self.pos = self.scan(self.buf, self.pos)
+            except (ValueError, StopIteration):
+                # Incomplete, or with comments
+                pass
+            else:
+                return value
+        if c == '{':
+            return self._readObject(keep)
+        elif c == '[':
+            return self._readArray(keep)
+        elif c == '"':
+            if keep:
+                return self._readString()
+            self._skipString()
+            return None
+        elif c == '-' or c.isdigit():
+            return self._readNumber()
+        elif c:
+            return self._readConstant()
+        else:
+            self._error('unexpected end of stream')
+
+    def _readObject(self, keep):
+        self.pos += 1
+        obj = self.Object()
+        if self._peek() == '}':
+            self.pos += 1
+            return self._digestObject(obj)
+        while True:
+            if self._peek() != '"':
+                self._error('expecting property name')
+            name = self._readString()
+            self._expect(':')
+            if self.strip_images and name.startswith('__') and name.endswith('__'):
+                if name == '__class__':
+                    keep = False
+                    obj = None
+                self._readValue(False)
+            else:
+                value = self._readValue(keep)
+                if keep:
+                    obj[name] = value
+            c = self._peek()
+            self.pos += 1
+            if c == '}':
+                return self._digestObject(obj)
+            if c != ',':
+                self.pos -= 1
+                self._error('expecting \',\' delimiter')
+
+    def _digestObject(self, obj):
+        if self.digests and obj is not None:
+            digestObject(obj)
+        return obj
+
+    def _readArray(self, keep):
+        self.pos += 1
+        array = self.Array()
+        if self._peek() == ']':
+            self.pos += 1
+            return self._digestArray(array)
+        while True:
+            value = self._readValue(keep)
+            if keep:
+                array.append(value)
+            c = self._peek()
+            self.pos += 1
+            if c == ']':
+                return self._digestArray(array)
+            if c != ',':
+                self.pos -= 1
+                self._error('expecting \',\' delimiter')
+
+    def _digestArray(self, array):
+        if self.digests:
+            digestArray(array)
+        return array
+
+    def load(self):
+        '''Load the next document.'''
+        return self._readValue()
+
+    def loadAll(self):
+        '''Load consecutive documents, until the end of the stream.'''
+        while self._peek():
+            yield self._readValue()
+
+
+def load(stream, strip_images = True, strip_comments = True, digests = False):
+    return Loader(stream, strip_images, strip_comments, digests).load()
+
+
+def load_all(stream, strip_images = True, strip_comments = True, digests = False):
+    '''Incrementally load consecutive JSON documents, such as the states
+    dumped by retrace for a call set, yielding each one as soon as it has been
+    read.'''
+    return Loader(stream, strip_images, strip_comments, digests).loadAll()
 
 
 def main():
@@ -343,14 +647,22 @@ def main():
         '--keep-images',
         action="store_false", dest="strip_images", default=True,
         help="compare images")
+    optparser.add_option(
+        '--ubjson',
+        action="store_true", dest="ubjson", default=False,
+        help="read UBJSON state dumps")
 
     (options, args) = optparser.parse_args(sys.argv[1:])
 
     if len(args) != 2:
         optparser.error('incorrect number of arguments')
 
-    a = load(open(args[0], 'rt'), options.strip_images)
-    b = load(open(args[1], 'rt'), options.strip_images)
+    if options.ubjson:
+        a = hashTree(ubjson.load(open(args[0], 'rb'), options.strip_images))
+        b = hashTree(ubjson.load(open(args[1], 'rb'), options.strip_images))
+    else:
+        a = load(open(args[0], 'rt'), options.strip_images, digests = True)
+        b = load(open(args[1], 'rt'), options.strip_images, digests = True)
 
     if False:
         dumper = Dumper()
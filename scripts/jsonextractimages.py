@@ -33,6 +33,8 @@ import optparse
 import base64
 import sys
 
+import ubjson
+
 
 pngSignature = b"\x89\x50\x4E\x47\x0D\x0A\x1A\x0A"
 
@@ -40,12 +42,15 @@ pngSignature = b"\x89\x50\x4E\x47\x0D\x0A\x1A\x0A"
 def dumpSurfaces(state, memberName):
     for name, imageObj in state[memberName].items():
         data = imageObj['__data__']
-        data = base64.b64decode(data)
+        if isinstance(data, str):
+            data = base64.b64decode(data)
+        # UBJSON blobs are memoryviews
+        header = bytes(data[:len(pngSignature)])
 
-        if data.startswith(pngSignature):
+        if header.startswith(pngSignature):
             extName = 'png'
         else:
-            magic = data[:2]
+            magic = header[:2]
             if magic in (b'P1', b'P4'):
                 extName = 'pbm'
             elif magic in (b'P2', b'P5'):
@@ -66,11 +71,18 @@ def dumpSurfaces(state, memberName):
 def main():
     optparser = optparse.OptionParser(
         usage="\n\t%prog [options] <json>")
+    optparser.add_option(
+        '--ubjson',
+        action="store_true", dest="ubjson", default=False,
+        help="read UBJSON state dumps")
 
     (options, args) = optparser.parse_args(sys.argv[1:])
 
     for arg in args:
-        state = json.load(open(arg, 'rt'), strict=False)
+        if options.ubjson:
+            state = ubjson.load(open(arg, 'rb'), strip_images=False)
+        else:
+            state = json.load(open(arg, 'rt'), strict=False)
 
         dumpSurfaces(state, 'textures')
         dumpSurfaces(state, 'framebuffer')
@@ -25,28 +25,88 @@
 ##########################################################################/
 
 
-import subprocess
 import sys
 import os.path
 import optparse
-import re
 
 import unpickle
 
+try:
+    # Generated at build time by leakspecs.py
+    import leakstables
+except ImportError:
+    # Not installed -- derive the tables from the specs in the source tree
+    import leakspecs as leakstables
+
+
+def _values(value):
+    if isinstance(value, (list, tuple)):
+        return value
+    else:
+        return [value]
+
+
+# Context entry-points, and the index of the context and shared context args
+contextCreators = {
+    'CGLCreateContext': (2, 1),
+    'eglCreateContext': (None, 2),
+    'glXCreateContext': (None, 2),
+    'glXCreateNewContext': (None, 3),
+    'glXCreateContextAttribsARB': (None, 2),
+    'glXCreateContextWithConfigSGIX': (None, 3),
+    'wglCreateContext': (None, None),
+    'wglCreateContextAttribsARB': (None, 1),
+}
+
+contextDestroyers = {
+    'CGLDestroyContext': 0,
+    'glXDestroyContext': 1,
+    'eglDestroyContext': 1,
+    'wglDeleteContext': 0,
+}
+
+contextMakers = {
+    'CGLSetCurrentContext': 0,
+    'eglMakeCurrent': 3,
+    'glXMakeCurrent': 2,
+    'glXMakeContextCurrent': 3,
+    'glXMakeCurrentReadSGI': 3,
+    'wglMakeCurrent': 1,
+    'wglMakeContextCurrentARB': 2,
+    'wglMakeContextCurrentEXT': 2,
+}
+
 
 class LeakDetector(unpickle.Unpickler):
 
-    def __init__(self, apitrace, trace):
+    handleCreators = leakstables.handleCreators
+    handleDeleters = leakstables.handleDeleters
+    perContextKinds = leakstables.perContextKinds
+
+    comCreators = leakstables.comCreators
+    comRefcounters = leakstables.comRefcounters
 
-        cmd = [apitrace, 'pickle', '--symbolic', trace]
-        p = subprocess.Popen(args = cmd, stdout=subprocess.PIPE)
+    def __init__(self, apitrace, trace, cache=None):
 
-        unpickle.Unpickler.__init__(self, p.stdout)
+        stream = unpickle.openTrace(apitrace, trace, ['--symbolic', '--lazy-args'], cache)
+
+        unpickle.Unpickler.__init__(self, stream)
 
         self.numContexts = 0
+        self.currentContext = None
+
+        # share group of every live context
+        self.contextGroups = {}
 
-        # a map of maps
-        self.objectDicts = {}
+        # number of live contexts in every share group
+        self.groupContexts = {}
+
+        # a map of maps per share group, and per context
+        self.sharedObjectDicts = {}
+        self.contextObjectDicts = {}
+
+        # live COM objects, as [creationCallNo, kind, refcount] lists
+        self.comObjects = {}
 
     def parse(self):
         unpickle.Unpickler.parse(self)
@@ -54,8 +114,6 @@ class LeakDetector(unpickle.Unpickler):
         # Reached the end of the trace -- dump any live objects
         self.dumpLeaks("<EOF>")
 
-    genDelRegExp = re.compile('^gl(Gen|Delete)(Buffers|Textures|FrameBuffers|RenderBuffers)[A-Z]*$')
-
     def handleCall(self, call):
         # Ignore calls without side effects
         if call.flags & unpickle.CALL_FLAG_NO_SIDE_EFFECTS:
@@ -65,73 +123,192 @@ class LeakDetector(unpickle.Unpickler):
         if 0:
             sys.stderr.write('%s\n' % call)
 
-        mo = self.genDelRegExp.match(call.functionName)
-        if mo:
-            verb = mo.group(1)
-            subject = mo.group(2)
+        name = call.functionName
 
-            subject = subject.lower().rstrip('s')
-            objectDict = self.objectDicts.setdefault(subject, {})
+        entries = self.handleCreators.get(name)
+        if entries is not None:
+            self.handleGenerate(call, entries)
+            return
 
-            if verb == 'Gen':
-                self.handleGenerate(call, objectDict)
-            elif verb == 'Delete':
-                self.handleDelete(call, objectDict)
-            else:
-                assert 0
+        entries = self.handleDeleters.get(name)
+        if entries is not None:
+            self.handleDelete(call, entries)
+            return
 
         # TODO: Track labels via glObjectLabel* calls
 
-        if call.functionName in [
-            'CGLCreateContext',
-            'eglCreateContext',
-            'glXCreateContext',
-            'glXCreateNewContext',
-            'glXCreateContextAttribsARB',
-            'glXCreateContextWithConfigSGIX',
-            'wglCreateContext',
-            'wglCreateContextAttribsARB',
-        ]:
+        method = self.comRefcounters.get(name)
+        if method is not None:
+            self.handleRefcount(call, method)
+            return
+
+        entries = self.comCreators.get(name)
+        if entries is not None:
+            self.handleQuery(call, entries)
+
+        if name in contextCreators:
+            self.handleCreateContext(call, *contextCreators[name])
+        elif name in contextDestroyers:
+            self.handleDestroyContext(call, contextDestroyers[name])
+        elif name in contextMakers:
+            context = call.argValues()[contextMakers[name]]
+            self.currentContext = context if context else None
+        elif name == 'wglShareLists':
+            self.handleShareLists(call)
+
+    def getObjectDict(self, kind):
+        context = self.currentContext
+        if kind in self.perContextKinds:
+            objectDicts = self.contextObjectDicts.setdefault(context, {})
+        else:
+            group = self.contextGroups.get(context, context)
+            objectDicts = self.sharedObjectDicts.setdefault(group, {})
+        return objectDicts.setdefault(kind, {})
+
+    def iterNames(self, call, entries):
+        args = call.argValues()
+        for index, kind, rangeIndex in entries:
+            if index is None:
+                value = call.ret
+            else:
+                value = args[index]
+            if rangeIndex is None:
+                names = _values(value)
+            elif value:
+                names = range(value, value + args[rangeIndex])
+            else:
+                names = []
+            yield kind, names
+
+    def handleGenerate(self, call, entries):
+        for kind, names in self.iterNames(call, entries):
+            objectDict = self.getObjectDict(kind)
+            for name in names:
+                if name:
+                    objectDict[name] = call.no
+                # TODO: Keep track of call stack backtrace too
+
+    def handleDelete(self, call, entries):
+        for kind, names in self.iterNames(call, entries):
+            objectDict = self.getObjectDict(kind)
+            for name in names:
+                try:
+                    del objectDict[name]
+                except KeyError:
+                    # Ignore if object name was never generated
+                    pass
+
+    def handleQuery(self, call, entries):
+        if unpickle.failed(call.ret):
+            return
+        args = call.argValues()
+        for index, kind in entries:
+            for obj in _values(args[index]):
+                if not obj:
+                    continue
+                try:
+                    self.comObjects[obj][2] += 1
+                except KeyError:
+                    self.comObjects[obj] = [call.no, kind, 1]
+
+    def handleRefcount(self, call, method):
+        obj = call.argValues()[0]
+        try:
+            entry = self.comObjects[obj]
+        except KeyError:
+            # Ignore objects created outside the trace
+            return
+        if isinstance(call.ret, int):
+            entry[2] = call.ret
+        elif method == 'AddRef':
+            entry[2] += 1
+        else:
+            entry[2] -= 1
+        if entry[2] <= 0:
+            del self.comObjects[obj]
+
+    def handleCreateContext(self, call, contextIndex, shareIndex):
+        args = call.argValues()
+        if contextIndex is None:
+            context = call.ret
+        else:
+            context = _values(args[contextIndex])[0]
+        if not context:
+            return
+        share = None
+        if shareIndex is not None:
+            share = args[shareIndex]
+        group = self.contextGroups.get(share, context)
+        self.contextGroups[context] = group
+        self.groupContexts[group] = self.groupContexts.get(group, 0) + 1
+        self.numContexts += 1
+
+    def handleShareLists(self, call):
+        share, context = call.argValues()
+        if share not in self.contextGroups or context not in self.contextGroups:
+            return
+        oldGroup = self.contextGroups[context]
+        group = self.contextGroups[share]
+        if oldGroup == group:
+            return
+        self.contextGroups[context] = group
+        self.groupContexts[oldGroup] -= 1
+        self.groupContexts[group] += 1
+        if self.groupContexts[oldGroup] == 0:
+            del self.groupContexts[oldGroup]
+            objectDicts = self.sharedObjectDicts.pop(oldGroup, {})
+            for kind, objectDict in objectDicts.items():
+                self.sharedObjectDicts.setdefault(group, {}).setdefault(kind, {}).update(objectDict)
+
+    def handleDestroyContext(self, call, contextIndex):
+        context = call.argValues()[contextIndex]
+        try:
+            group = self.contextGroups.pop(context)
+        except KeyError:
             # FIXME: Ignore failing context creation calls
-            self.numContexts += 1
-
-        if call.functionName in [
-            'CGLDestroyContext',
-            'glXDestroyContext',
-            'eglDestroyContext',
-            'wglDeleteContext',
-        ]:
-            assert self.numContexts > 0
-            self.numContexts -= 1
-            if self.numContexts == 0:
-                self.dumpLeaks(call.no)
-
-    def handleGenerate(self, call, objectDict):
-        n, names = call.argValues()
-        for i in range(n):
-            name = names[i]
-            objectDict[name] = call.no
-            # TODO: Keep track of call stack backtrace too
-
-    def handleDelete(self, call, objectDict):
-        n, names = call.argValues()
-        for i in range(n):
-            name = names[i]
-            try:
-                del objectDict[name]
-            except KeyError:
-                # Ignore if texture name was never generated
-                pass
+            return
+
+        assert self.numContexts > 0
+        self.numContexts -= 1
+
+        self.dumpObjectDicts(call.no, self.contextObjectDicts.pop(context, {}))
+
+        self.groupContexts[group] -= 1
+        if self.groupContexts[group] == 0:
+            del self.groupContexts[group]
+            self.dumpObjectDicts(call.no, self.sharedObjectDicts.pop(group, {}))
+
+        if self.currentContext == context:
+            self.currentContext = None
+
+        if self.numContexts == 0:
+            self.dumpLeaks(call.no)
 
     def dumpLeaks(self, currentCallNo):
-        for kind, objectDict in self.objectDicts.items():
+        for objectDicts in self.contextObjectDicts.values():
+            self.dumpObjectDicts(currentCallNo, objectDicts)
+        for objectDicts in self.sharedObjectDicts.values():
+            self.dumpObjectDicts(currentCallNo, objectDicts)
+        self.contextObjectDicts.clear()
+        self.sharedObjectDicts.clear()
+
+        if currentCallNo == "<EOF>":
+            self.dumpObjectLeaks(currentCallNo)
+
+    def dumpObjectDicts(self, currentCallNo, objectDicts):
+        for kind, objectDict in objectDicts.items():
             self.dumpNamespaceLeaks(currentCallNo, objectDict, kind)
 
     def dumpNamespaceLeaks(self, currentCallNo, objectDict, kind):
         for name, creationCallNo in (sorted(iter(objectDict.items()),key=lambda t: t[1])):
-            sys.stderr.write('%u: error: %s %u was not destroyed until %s\n' % (creationCallNo, kind, name, currentCallNo))
+            sys.stderr.write('%u: error: %s %s was not destroyed until %s\n' % (creationCallNo, kind, name, currentCallNo))
         objectDict.clear()
 
+    def dumpObjectLeaks(self, currentCallNo):
+        for obj, (creationCallNo, kind, refcount) in sorted(self.comObjects.items(), key=lambda t: t[1][0]):
+            sys.stderr.write('%u: error: %s %s was not released until %s (refcount %u)\n' % (creationCallNo, kind, obj, currentCallNo, refcount))
+        self.comObjects.clear()
+
 
 def main():
     '''Main program.
@@ -145,6 +322,7 @@ def main():
         '-a', '--apitrace', metavar='PROGRAM',
         type='string', dest='apitrace', default='apitrace',
         help='apitrace command [default: %default]')
+    unpickle.addCacheOptions(optparser)
 
     options, args = optparser.parse_args(sys.argv[1:])
     if len(args) != 1:
@@ -155,7 +333,7 @@ def main():
         sys.stderr.write("error: `%s` does not exist\n" % inTrace)
         sys.exit(1)
 
-    detector = LeakDetector(options.apitrace, inTrace)
+    detector = LeakDetector(options.apitrace, inTrace, unpickle.getCache(options))
     detector.parse()
 
 
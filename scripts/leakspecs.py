@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+##########################################################################
+#
+# Copyright 2026 The apitrace authors
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+##########################################################################/
+
+
+'''Derive the object tracking tables of leaks.py from the API specs.
+
+When run, writes the tables to the standard output as a Python module
+(leakstables.py), which is generated at build time and installed along with
+the scripts, as the specs themselves are not installed.
+'''
+
+
+import os.path
+import sys
+
+# Adjust path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from specs import stdapi
+from specs import winapi
+from specs.gltypes import contextKey
+from specs.glapi import glapi
+from specs.d3d8 import d3d8
+from specs.d3d9 import d3d9
+from specs.d3d10 import d3d10, d3d10_1
+from specs.d3d11 import d3d11
+from specs.dxgi import dxgi
+from specs.d2d1 import d2d1
+from specs.dcomp import dcomp
+from specs.dwrite import dwrite
+
+
+class HandleCollector(stdapi.Traverser):
+    '''Collect the handles referred by a type.'''
+
+    def __init__(self):
+        self.handles = []
+
+    def visitHandle(self, handle):
+        self.handles.append(handle)
+
+
+class ObjPointerCollector(stdapi.Traverser):
+    '''Collect the interfaces pointed by a type.'''
+
+    def __init__(self):
+        self.interfaces = []
+
+    def visitObjPointer(self, pointer):
+        self.interfaces.append(pointer.type)
+
+
+def _handles(type):
+    collector = HandleCollector()
+    collector.visit(type)
+    return collector.handles
+
+
+def _argIndex(function, name):
+    for arg in function.args:
+        if arg.name == name:
+            return arg.index
+    return None
+
+
+def buildHandleTables(functions):
+    '''Build the creator/deleter tables from the stdapi.Handle declarations.
+
+    Returns a (creators, deleters, perContext) tuple, where creators and
+    deleters map function names to lists of (argIndex, kind, rangeIndex)
+    tuples, argIndex being None for the return value, and perContext is the
+    set of kinds whose names are not shared between contexts.
+    '''
+
+    creators = {}
+    deleters = {}
+    perContext = set()
+
+    # Ranged handles (i.e., display lists) are usually deleted with an
+    # argument of the same name as the creator's, e.g. glDeleteLists' range.
+    ranges = {}
+    for function in functions:
+        for handle in _handles(function.type):
+            if handle.range is not None:
+                ranges[handle.name] = handle.range
+
+    for function in functions:
+        if not function.sideeffects:
+            continue
+
+        isDeleter = function.name.startswith('glDelete')
+
+        entries = []
+        if not isDeleter:
+            for handle in _handles(function.type):
+                entries.append((None, handle.name, _argIndex(function, handle.range)))
+        for arg in function.args:
+            if arg.output == isDeleter:
+                continue
+            for handle in _handles(arg.type):
+                rangeIndex = _argIndex(function, handle.range or ranges.get(handle.name))
+                entries.append((arg.index, handle.name, rangeIndex))
+                if handle.key is contextKey:
+                    perContext.add(handle.name)
+
+        if entries:
+            if isDeleter:
+                deleters[function.name] = entries
+            else:
+                creators[function.name] = entries
+
+    # Some deletion entry-points take plain GLuint names (e.g.
+    # glDeleteProgramPipelines), so pair them with their creators by name.
+    for function in functions:
+        if not function.name.startswith('glDelete') or function.name in deleters:
+            continue
+        suffix = function.name[len('glDelete'):]
+        for prefix in ('glGen', 'glCreate'):
+            try:
+                entries = creators[prefix + suffix]
+            except KeyError:
+                continue
+            kind = entries[0][1]
+            deleters[function.name] = [(function.args[-1].index, kind, None)]
+            break
+
+    # Only track the kinds which can actually be destroyed (e.g., not
+    # uniform locations or bindless texture handles.)
+    kinds = set()
+    for entries in deleters.values():
+        for index, kind, rangeIndex in entries:
+            kinds.add(kind)
+    for name in list(creators.keys()):
+        entries = [entry for entry in creators[name] if entry[1] in kinds]
+        if entries:
+            creators[name] = entries
+        else:
+            del creators[name]
+
+    return creators, deleters, perContext
+
+
+def buildInterfaceTables(modules):
+    '''Build the COM tables from the Interface declarations.
+
+    Returns a (creators, refcounters) tuple, where creators maps function and
+    method names to lists of (argIndex, kind) tuples for the output interface
+    pointers (argIndex counting the implicit `this` argument of methods),
+    and refcounters maps the AddRef/Release method names to their IUnknown
+    method name.
+    '''
+
+    api = stdapi.API()
+    for module in modules:
+        api.addModule(module)
+
+    creators = {}
+    refcounters = {}
+
+    def addFunction(name, function):
+        entries = []
+        for arg in function.args:
+            if not arg.output:
+                continue
+            collector = ObjPointerCollector()
+            collector.visit(arg.type)
+            for interface in collector.interfaces:
+                if isinstance(interface, stdapi.Interface):
+                    kind = interface.name
+                else:
+                    kind = 'IUnknown'
+                entries.append((arg.index, kind))
+        if entries:
+            creators[name] = entries
+
+    for function in api.getAllFunctions():
+        addFunction(function.name, function)
+
+    for interface in api.getAllInterfaces():
+        if not interface.hasBase(winapi.IUnknown):
+            continue
+        for method in interface.iterMethods():
+            name = interface.name + '::' + method.name
+            if method.name in ('AddRef', 'Release'):
+                refcounters[name] = method.name
+            else:
+                addFunction(name, method)
+
+    return creators, refcounters
+
+
+handleCreators, handleDeleters, perContextKinds = buildHandleTables(glapi.functions)
+
+comCreators, comRefcounters = buildInterfaceTables([
+    d3d8,
+    d3d9,
+    d3d10,
+    d3d10_1,
+    d3d11,
+    dxgi,
+    d2d1,
+    dcomp,
+    dwrite,
+])
+
+
+def _writeDict(name, table):
+    sys.stdout.write('%s = {\n' % name)
+    for key in sorted(table):
+        sys.stdout.write('    %r: %r,\n' % (key, table[key]))
+    sys.stdout.write('}\n\n')
+
+
+def main():
+    sys.stdout.write("'''Object tracking tables of leaks.py.\n")
+    sys.stdout.write('\n')
+    sys.stdout.write("Generated from the API specs by leakspecs.py -- do not edit.'''\n")
+    sys.stdout.write('\n\n')
+    _writeDict('handleCreators', handleCreators)
+    _writeDict('handleDeleters', handleDeleters)
+    sys.stdout.write('perContextKinds = set(%r)\n\n' % sorted(perContextKinds))
+    _writeDict('comCreators', comCreators)
+    _writeDict('comRefcounters', comRefcounters)
+
+
+if __name__ == '__main__':
+    main()
@@ -25,99 +25,402 @@
 ##########################################################################/
 
 
+import array
+import csv
 import optparse
+import os
 import sys
 
 
-def process(stream, groupField):
-    times = {}
+percentiles = (50, 95, 99)
 
-    # Read header describing fields
-    header = stream.readline()
-    assert header.startswith('#')
 
-    fields = header.rstrip('\r\n').split(' ')[1:]
+# Metric names written by `glretrace --pcalls/--pdrawcalls`, and the
+# corresponding `glretrace --pgpu/--pcpu/--ppd` fields
+_metricAliases = {
+    'call no': 'no',
+    'GPU Start': 'gpu_start',
+    'GPU Duration': 'gpu_dura',
+    'CPU Start': 'cpu_start',
+    'CPU Duration': 'cpu_dura',
+    'Pixels Drawn': 'pixels',
+}
+
+
+class Group:
+    '''Aggregated metrics of the calls in a group.'''
+
+    __slots__ = ['draws', 'duration', 'longest', 'longestDuration', 'durations', 'cpuDuration', 'pixels']
+
+    def __init__(self):
+        self.draws = 0
+        self.duration = 0
+        self.longest = None
+        self.longestDuration = -1
+        self.durations = array.array('q')
+        self.cpuDuration = 0
+        self.pixels = 0
+
+    def add(self, callId, duration, cpuDuration, pixels):
+        self.draws += 1
+        self.duration += duration
+        if duration > self.longestDuration:
+            self.longest = callId
+            self.longestDuration = duration
+        self.durations.append(duration)
+        self.cpuDuration += cpuDuration
+        self.pixels += pixels
+
+    def merge(self, other):
+        self.draws += other.draws
+        self.duration += other.duration
+        if other.longestDuration > self.longestDuration:
+            self.longest = other.longest
+            self.longestDuration = other.longestDuration
+        self.durations.extend(other.durations)
+        self.cpuDuration += other.cpuDuration
+        self.pixels += other.pixels
+
+    def percentiles(self, ps):
+        '''Nearest-rank percentiles of the durations.'''
+        durations = sorted(self.durations)
+        n = len(durations)
+        return [durations[max(-(-p * n // 100) - 1, 0)] for p in ps]
+
+    def nsPerPixel(self):
+        if not self.pixels:
+            return None
+        return self.duration / self.pixels
+
+    def bound(self):
+        '''Whether the calls spend longer on the GPU or on the CPU.'''
+        if not self.duration or not self.cpuDuration:
+            return None
+        if self.duration > self.cpuDuration:
+            return 'GPU'
+        else:
+            return 'CPU'
+
+    def __getstate__(self):
+        return self.draws, self.duration, self.longest, self.longestDuration, self.durations, self.cpuDuration, self.pixels
+
+    def __setstate__(self, state):
+        self.draws, self.duration, self.longest, self.longestDuration, self.durations, self.cpuDuration, self.pixels = state
+
+
+def parseHeader(header):
+    '''Map the field names in the header line to column indices, returning
+    the field separator and the columns.'''
+
+    assert header.startswith(b'#')
+    header = header.rstrip(b'\r\n')
+    if b'\t' in header:
+        # Metrics, with a tab separated column per field
+        separator = b'\t'
+        fields = header.split(separator)
+    else:
+        separator = None
+        fields = header.split(b' ')[1:]
     columns = {}
     for column in range(len(fields)):
-        columns[fields[column]] = column
+        name = fields[column].decode()
+        columns[name] = column
+        try:
+            columns[_metricAliases[name]] = column
+        except KeyError:
+            pass
+    return separator, columns
+
+
+def parseNumber(field):
+    '''Parse a metric field, as an int or float, or 0 when missing.'''
+    try:
+        return int(field)
+    except ValueError:
+        try:
+            return float(field)
+        except ValueError:
+            # Missing (-) or failed (#ERR) metric
+            return 0
+
 
-    callCol = columns['call']
+def processStream(stream, header, groupFields, pos = 0, end = None):
+    '''Aggregate the calls in the lines of a profile, stopping at the line
+    starting at or after the end offset, if any.
+
+    Groups are keyed by tuples of the group fields, where the frame field is
+    the number of the frame within the lines read, and the number of frames
+    read is returned too.'''
+
+    separator, columns = header
     callIdCol = columns['no']
     gpuDuraCol = columns['gpu_dura']
-    programCol = columns['program']
-    funcNameCol = columns['name']
+    cpuDuraCol = columns.get('cpu_dura')
+    pixelsCol = columns.get('pixels')
+    groupCols = []
+    for groupField in groupFields:
+        if groupField == 'frame':
+            groupCols.append(None)
+        else:
+            groupCols.append(columns[groupField])
 
-    groupCol = columns[groupField]
+    if separator is None:
+        number = int
+    else:
+        number = parseNumber
+    if len(groupCols) == 1 and groupCols[0] is not None:
+        groupCol = groupCols[0]
+    else:
+        groupCol = None
 
-    maxGroupLen = 0
+    groups = {}
+    frame = 0
 
     for line in stream:
-        fields = line.rstrip('\r\n').split(' ')
+        if end is not None:
+            if pos >= end:
+                break
+            pos += len(line)
+
+        if not line.startswith(b'call'):
+            if line.startswith(b'frame_end'):
+                frame += 1
+            continue
 
-        if line.startswith('#'):
+        if separator is None:
+            fields = line.split()
+        else:
+            fields = line.rstrip(b'\r\n').split(separator)
+        if fields[0] != b'call':
             continue
 
-        if fields[callCol] == 'call':
-            callId = int(fields[callIdCol])
-            duration = int(fields[gpuDuraCol])
-            group = fields[groupCol]
+        if groupCol is not None:
+            group = (fields[groupCol],)
+        else:
+            group = tuple([frame if col is None else fields[col] for col in groupCols])
+        try:
+            aggregate = groups[group]
+        except KeyError:
+            aggregate = groups[group] = Group()
+        aggregate.add(
+            int(fields[callIdCol]),
+            number(fields[gpuDuraCol]),
+            0 if cpuDuraCol is None else number(fields[cpuDuraCol]),
+            0 if pixelsCol is None else number(fields[pixelsCol]),
+        )
+
+    return groups, frame
+
+
+def processRange(path, start, end, header, groupFields):
+    '''Aggregate the calls in the lines starting in the [start, end) byte
+    range of a profile.'''
 
-            maxGroupLen = max(maxGroupLen, len(group))
+    with open(path, 'rb') as stream:
+        if start > 0:
+            # Skip to the beginning of the next line
+            stream.seek(start - 1)
+            start += len(stream.readline()) - 1
+        return processStream(stream, header, groupFields, start, end)
 
-            if group in times:
-                times[group]['draws'] += 1
-                times[group]['duration'] += duration
 
-                if duration > times[group]['longestDuration']:
-                    times[group]['longest'] = callId
-                    times[group]['longestDuration'] = duration
-            else:
-                times[group] = {'draws': 1, 'duration': duration, 'longest': callId, 'longestDuration': duration}
+def mergeGroups(groups, others, frameIndex = None, frameOffset = 0):
+    '''Merge groups, renumbering the frames in the others' keys.'''
+    for group, aggregate in others.items():
+        if frameIndex is not None:
+            group = group[:frameIndex] + (group[frameIndex] + frameOffset,) + group[frameIndex + 1:]
+        try:
+            groups[group].merge(aggregate)
+        except KeyError:
+            groups[group] = aggregate
 
-    times = sorted(list(times.items()), key=lambda x: x[1]['duration'], reverse=True)
 
-    if groupField == 'program':
-        groupTitle = 'Shader[id]'
+def process(paths, groupFields, jobs = 1, chunkSize = 64 << 20):
+    '''Aggregate the calls from several profiles (or stdin, if none is
+    given), optionally in parallel byte ranges.
+
+    Frames are numbered from the start of each profile.'''
+
+    if 'frame' in groupFields:
+        frameIndex = groupFields.index('frame')
     else:
-        groupTitle = groupField
-    maxGroupLen = max(maxGroupLen, len(groupTitle))
-    groupTitle = groupField.center(maxGroupLen)
-    groupLine = '-' * maxGroupLen
+        frameIndex = None
+
+    tasks = []
+    for path in paths:
+        stream = open(path, 'rb')
+        line = stream.readline()
+        stream.close()
+        header = parseHeader(line)
+        size = os.path.getsize(path)
+        if jobs > 1:
+            starts = range(len(line), size, chunkSize)
+        else:
+            starts = [len(line)]
+        for start in starts:
+            task = (path, start, min(start + chunkSize, size) if jobs > 1 else size, header, groupFields)
+            tasks.append(task)
+
+    groups = {}
+    if not paths:
+        stream = sys.stdin.buffer
+        header = parseHeader(stream.readline())
+        results = [processStream(stream, header, groupFields)]
+    elif jobs > 1 and len(tasks) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(jobs)
+        results = [executor.submit(processRange, *task) for task in tasks]
+        results = [future.result() for future in results]
+        executor.shutdown()
+    else:
+        results = [processRange(*task) for task in tasks]
+
+    frameOffset = 0
+    lastPath = None
+    for task, (others, frames) in zip(tasks or [(None,)], results):
+        if task[0] != lastPath:
+            frameOffset = 0
+            lastPath = task[0]
+        mergeGroups(groups, others, frameIndex, frameOffset)
+        frameOffset += frames
+
+    result = {}
+    for group, aggregate in groups.items():
+        result[tuple([str(key) if isinstance(key, int) else key.decode() for key in group])] = aggregate
+    return result
+
+
+sortKeys = {
+    'duration': lambda aggregate: aggregate.duration,
+    'cpu': lambda aggregate: aggregate.cpuDuration,
+    'draws': lambda aggregate: aggregate.draws,
+    'pixels': lambda aggregate: aggregate.pixels,
+    'ns_per_pixel': lambda aggregate: aggregate.nsPerPixel() or 0,
+}
+
+
+def _rows(groups, sortKey):
+    '''Rows of (group key values, aggregate), in descending order.'''
+    key = sortKeys[sortKey]
+    return sorted(list(groups.items()), key=lambda x: key(x[1]), reverse=True)
+
+
+def _format(value, digits = 0):
+    if value is None:
+        return '-'
+    if digits:
+        return '%.*f' % (digits, value)
+    return str(value)
 
-    print('+-%s-+--------------+--------------------+--------------+-------------+' % groupLine)
-    print('| %s |   Draws [#]  |   Duration [ns]  v | Per Call[ns] | Longest[id] |' % groupTitle)
-    print('+-%s-+--------------+--------------------+--------------+-------------+' % groupLine)
 
-    for group in times:
-        id = str(group[0]).rjust(maxGroupLen)
-        draw = str(group[1]['draws']).rjust(12)
-        dura = str(group[1]['duration']).rjust(18)
-        perCall = str(group[1]['duration'] // group[1]['draws']).rjust(12)
-        longest = str(group[1]['longest']).rjust(11)
-        print("| %s | %s | %s | %s | %s |" % (id, draw, dura, perCall, longest))
+def report(groups, groupFields, sortKey = 'duration'):
+    rows = _rows(groups, sortKey)
 
-    print('+-%s-+--------------+--------------------+--------------+-------------+' % groupLine)
+    groupTitles = []
+    groupLens = []
+    for i in range(len(groupFields)):
+        groupField = groupFields[i]
+        maxGroupLen = 0
+        for group in groups:
+            maxGroupLen = max(maxGroupLen, len(group[i]))
+        if groupField == 'program':
+            groupTitle = 'Shader[id]'
+        else:
+            groupTitle = groupField
+        maxGroupLen = max(maxGroupLen, len(groupTitle))
+        groupTitles.append(groupField.center(maxGroupLen))
+        groupLens.append(maxGroupLen)
+    groupTitle = ' | '.join(groupTitles)
+    groupLine = '-+-'.join(['-' * maxGroupLen for maxGroupLen in groupLens])
+
+    # Mark the sort column
+    durationTitle = '  Duration [ns]  %s' % ('v' if sortKey == 'duration' else ' ')
+    drawsTitle = '  Draws [#]%s' % ('v' if sortKey == 'draws' else ' ')
+    extraTitles = [
+        ('CPU [ns]', 'cpu'),
+        ('Pixels [#]', 'pixels'),
+        ('ns/pixel', 'ns_per_pixel'),
+    ]
+
+    separator = '+-%s-+--------------+--------------------+--------------+-------------+' % groupLine
+    separator += '--------------+' * (len(percentiles) + len(extraTitles)) + '-------+'
+    print(separator)
+    print('| %s | %s | %s | Per Call[ns] | Longest[id] |' % (groupTitle, drawsTitle, durationTitle) +
+          ''.join([' p%-2u     [ns] |' % p for p in percentiles]) +
+          ''.join([' %s %s |' % (title.ljust(10), 'v' if sortKey == key else ' ') for title, key in extraTitles]) +
+          ' Bound |')
+    print(separator)
+
+    for group, aggregate in rows:
+        id = ' | '.join([group[i].rjust(groupLens[i]) for i in range(len(group))])
+        draw = str(aggregate.draws).rjust(12)
+        dura = str(aggregate.duration).rjust(18)
+        perCall = str(aggregate.duration // aggregate.draws).rjust(12)
+        longest = str(aggregate.longest).rjust(11)
+        line = "| %s | %s | %s | %s | %s |" % (id, draw, dura, perCall, longest)
+        for value in aggregate.percentiles(percentiles):
+            line += ' %s |' % str(value).rjust(12)
+        line += ' %s |' % str(aggregate.cpuDuration).rjust(12)
+        line += ' %s |' % str(aggregate.pixels).rjust(12)
+        line += ' %s |' % _format(aggregate.nsPerPixel(), 3).rjust(12)
+        line += ' %s |' % _format(aggregate.bound()).rjust(5)
+        print(line)
+
+    print(separator)
+
+
+def writeCsv(stream, groups, groupFields, sortKey = 'duration'):
+    writer = csv.writer(stream)
+    writer.writerow(list(groupFields) + ['draws', 'duration', 'per_call', 'longest'] +
+                    ['p%u' % p for p in percentiles] +
+                    ['cpu_duration', 'pixels', 'ns_per_pixel', 'bound'])
+    for group, aggregate in _rows(groups, sortKey):
+        nsPerPixel = aggregate.nsPerPixel()
+        writer.writerow(list(group) + [aggregate.draws, aggregate.duration,
+                         aggregate.duration // aggregate.draws, aggregate.longest] +
+                        aggregate.percentiles(percentiles) +
+                        [aggregate.cpuDuration, aggregate.pixels,
+                         '' if nsPerPixel is None else nsPerPixel,
+                         aggregate.bound() or ''])
 
 
 def main():
 
     # Parse command line options
     optparser = optparse.OptionParser(
-        usage='\n\t%prog [options] <profile_input>',
+        usage='\n\t%prog [options] <profile_input> ...',
         version='%%prog')
 
     optparser.add_option(
-        '-g', '--group', metavar='FIELD',
+        '-g', '--group', metavar='FIELD[,FIELD...]',
         type="string", dest="group", default='program',
-        help="group by specified field [default: %default]")
+        help="group by specified fields, such as program,frame [default: %default]")
+    optparser.add_option(
+        '-s', '--sort', metavar='KEY',
+        type="choice", choices=sorted(sortKeys.keys()), dest="sort", default='duration',
+        help="sort by %s [default: %%default]" % ', '.join(sorted(sortKeys.keys())))
+    optparser.add_option(
+        '-j', '--jobs', metavar='JOBS',
+        type="int", dest="jobs", default=1,
+        help="number of processes to parse the profiles with [default: %default]")
+    optparser.add_option(
+        '--csv', metavar='FILE',
+        type="string", dest="csv", default=None,
+        help="also write the table as CSV to FILE (- for stdout)")
     
     (options, args) = optparser.parse_args(sys.argv[1:])
 
-    if len(args):
-        for arg in args:
-            process(open(arg, 'rt'), options.group)
-    else:
-        process(sys.stdin, options.group)
+    groupFields = options.group.split(',')
+
+    groups = process(args, groupFields, options.jobs)
+
+    report(groups, groupFields, options.sort)
+
+    if options.csv == '-':
+        writeCsv(sys.stdout, groups, groupFields, options.sort)
+    elif options.csv:
+        with open(options.csv, 'wt', newline='') as stream:
+            writeCsv(stream, groups, groupFields, options.sort)
 
 
 if __name__ == '__main__':
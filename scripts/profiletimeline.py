@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+##########################################################################
+#
+# Copyright 2026 The apitrace authors
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+##########################################################################/
+
+
+'''Convert the output of `glretrace --pgpu --pcpu` into a timeline, in the
+Chrome trace event format, which can be viewed in chrome://tracing or
+https://ui.perfetto.dev/ .'''
+
+
+import json
+import optparse
+import sys
+
+from profileshader import parseHeader, parseNumber
+
+
+PID = 1
+
+# Track ids
+CPU_FRAMES = 0
+CPU_CALLS = 1
+GPU_FRAMES = 2
+GPU_CALLS = 3
+
+
+class TimelineWriter:
+    '''Write trace events as they come, without keeping them in memory.'''
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.first = True
+        self.gpuTracks = {}
+        self.stream.write('{"displayTimeUnit": "ns", "traceEvents": [\n')
+        self.nameTrack(CPU_FRAMES, 'CPU frames')
+        self.nameTrack(CPU_CALLS, 'CPU')
+        self.nameTrack(GPU_FRAMES, 'GPU frames')
+
+    def writeEvent(self, event):
+        if self.first:
+            self.first = False
+        else:
+            self.stream.write(',\n')
+        self.stream.write(json.dumps(event, separators=(',', ':')))
+
+    def nameTrack(self, tid, name):
+        self.writeEvent({'name': 'thread_name', 'ph': 'M', 'pid': PID, 'tid': tid, 'args': {'name': name}})
+        self.writeEvent({'name': 'thread_sort_index', 'ph': 'M', 'pid': PID, 'tid': tid, 'args': {'sort_index': tid}})
+
+    def gpuTrack(self, context):
+        try:
+            return self.gpuTracks[context]
+        except KeyError:
+            tid = GPU_CALLS + len(self.gpuTracks)
+            self.gpuTracks[context] = tid
+            if context is None:
+                self.nameTrack(tid, 'GPU')
+            else:
+                self.nameTrack(tid, 'GPU context %s' % context)
+            return tid
+
+    def writeSpan(self, tid, name, start, duration, args):
+        # Timestamps are in microseconds
+        self.writeEvent({'name': name, 'ph': 'X', 'pid': PID, 'tid': tid,
+                         'ts': start / 1000.0, 'dur': duration / 1000.0, 'args': args})
+
+    def close(self):
+        self.stream.write('\n]}\n')
+
+
+def process(stream, writer):
+    separator, columns = parseHeader(stream.readline())
+
+    callIdCol = columns['no']
+    nameCol = columns['name']
+    programCol = columns['program']
+    gpuStartCol = columns.get('gpu_start')
+    gpuDuraCol = columns.get('gpu_dura')
+    cpuStartCol = columns.get('cpu_start')
+    cpuDuraCol = columns.get('cpu_dura')
+    pixelsCol = columns.get('pixels')
+    # The profiles don't record contexts at the moment, but honour the
+    # column should it exist
+    contextCol = columns.get('context')
+
+    def value(fields, col):
+        if col is None:
+            return 0
+        return parseNumber(fields[col])
+
+    frameNo = 0
+    frameCpuStart = 0
+    frameGpuStart = 0
+    lastCpuTime = 0
+    lastGpuTime = 0
+
+    for line in stream:
+        if line.startswith(b'frame_end'):
+            # Frames span from the end of the previous frame to the end of
+            # its last call, like in the GUI
+            args = {'frame': frameNo}
+            if lastCpuTime > frameCpuStart:
+                writer.writeSpan(CPU_FRAMES, 'frame %u' % frameNo, frameCpuStart, lastCpuTime - frameCpuStart, args)
+                frameCpuStart = lastCpuTime
+            if lastGpuTime > frameGpuStart:
+                writer.writeSpan(GPU_FRAMES, 'frame %u' % frameNo, frameGpuStart, lastGpuTime - frameGpuStart, args)
+                frameGpuStart = lastGpuTime
+            frameNo += 1
+            continue
+
+        if not line.startswith(b'call'):
+            continue
+
+        if separator is None:
+            fields = line.split()
+        else:
+            fields = line.rstrip(b'\r\n').split(separator)
+        if fields[0] != b'call':
+            continue
+
+        name = fields[nameCol].decode()
+        args = {
+            'no': int(fields[callIdCol]),
+            'program': int(fields[programCol]),
+        }
+        if pixelsCol is not None:
+            args['pixels'] = parseNumber(fields[pixelsCol])
+
+        # Times are zero when not being profiled
+        cpuStart = value(fields, cpuStartCol)
+        cpuDuration = value(fields, cpuDuraCol)
+        if cpuStart or cpuDuration:
+            writer.writeSpan(CPU_CALLS, name, cpuStart, cpuDuration, args)
+            lastCpuTime = max(lastCpuTime, cpuStart + cpuDuration)
+
+        gpuStart = value(fields, gpuStartCol)
+        gpuDuration = value(fields, gpuDuraCol)
+        if gpuStart or gpuDuration:
+            if contextCol is None:
+                context = None
+            else:
+                context = fields[contextCol].decode()
+            writer.writeSpan(writer.gpuTrack(context), name, gpuStart, gpuDuration, args)
+            lastGpuTime = max(lastGpuTime, gpuStart + gpuDuration)
+
+
+def main():
+
+    # Parse command line options
+    optparser = optparse.OptionParser(
+        usage='\n\t%prog [options] [profile_input]',
+        version='%%prog')
+
+    optparser.add_option(
+        '-o', '--output', metavar='FILE',
+        type="string", dest="output", default=None,
+        help="output JSON file [default: stdout]")
+
+    (options, args) = optparser.parse_args(sys.argv[1:])
+
+    if len(args) > 1:
+        optparser.error('incorrect number of arguments')
+
+    if args:
+        stream = open(args[0], 'rb')
+    else:
+        stream = sys.stdin.buffer
+
+    if options.output:
+        output = open(options.output, 'wt')
+    else:
+        output = sys.stdout
+
+    writer = TimelineWriter(output)
+    process(stream, writer)
+    writer.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -28,18 +28,26 @@
 '''
 
 
+import hashlib
+import io
+import json
 import math
 import optparse
 import os.path
+import queue
+import shlex
 import subprocess
 import platform
 import sys
+import threading
+import zlib
 
 from PIL import Image
 
 from snapdiff import Comparer
 from highlight import AutoHighlighter
 import jsondiff
+import ubjson
 
 
 # Null file, to use when we're not interested in subprocesses output
@@ -47,12 +55,56 @@ NULL = open(os.path.devnull, 'wb')
 
 
 class RetraceRun:
+    '''Snapshots of a running retrace process.
 
-    def __init__(self, process):
+    Snapshots are read on a separate thread into a bounded queue, so that the
+    retrace process is not stalled while the previous snapshot is being
+    compared.  Images returned by nextSnapshot may share memory with the
+    reader buffers, and are only valid until the next snapshots are read.
+
+    If a recorder is given, snapshots are also saved to a SnapshotStore.
+    '''
+
+    def __init__(self, process, queueSize = 2, recorder = None):
         self.process = process
+        self.queue = queue.Queue(queueSize)
+        # One buffer being filled, one being consumed, plus the queued ones
+        self.reader = PNMReader(process.stdout, queueSize + 2)
+        self.recorder = recorder
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target = self._drain)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _drain(self):
+        try:
+            while True:
+                image, comment = self.reader.read()
+                if self.recorder is not None:
+                    if image is None:
+                        if self.process.wait() == 0:
+                            self.recorder.complete()
+                    else:
+                        self.recorder.record(int(comment.strip()), self.reader.header, self.reader.data)
+                if not self._put((image, comment)) or image is None:
+                    break
+        except Exception as ex:
+            self._put((ex, None))
+
+    def _put(self, item):
+        '''Queue item, unless terminated meanwhile.'''
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout = 0.1)
+            except queue.Full:
+                continue
+            return True
+        return False
 
     def nextSnapshot(self):
-        image, comment = read_pnm(self.process.stdout)
+        image, comment = self.queue.get()
+        if isinstance(image, Exception):
+            raise image
         if image is None:
             return None, None
 
@@ -61,19 +113,188 @@ class RetraceRun:
         return image, callNo
 
     def terminate(self):
+        self.stopped.set()
         try:
             self.process.terminate()
         except OSError:
             # Avoid http://bugs.python.org/issue14252
             pass
 
+        # Unblock the reader thread, which will stop at the end of the stream
+        while self.thread.is_alive():
+            try:
+                self.queue.get(timeout = 0.1)
+            except queue.Empty:
+                pass
+        self.thread.join()
+
+
+class CachedRun:
+    '''Snapshots served from a SnapshotStore, with the same interface as
+    RetraceRun.'''
+
+    def __init__(self, store, runKey, callNos):
+        self.store = store
+        self.runKey = runKey
+        self.callNos = iter(callNos)
+
+    def nextSnapshot(self):
+        for callNo in self.callNos:
+            image, comment = self.store.load(self.runKey, callNo)
+            if image is None:
+                raise Exception('snapshot of call %u evicted from the store' % callNo)
+            return image, callNo
+        return None, None
+
+    def terminate(self):
+        pass
+
+
+class SnapshotRecorder:
+
+    def __init__(self, store, runKey, call_nos):
+        self.store = store
+        self.runKey = runKey
+        self.call_nos = call_nos
+        self.callNos = []
+
+    def record(self, callNo, header, data):
+        self.store.save(self.runKey, callNo, header, data)
+        self.callNos.append(callNo)
+
+    def complete(self):
+        self.store.saveIndex(self.runKey, self.call_nos, self.callNos)
+        self.store.evict()
+
+
+class SnapshotStore:
+    '''Content addressed on-disk store of snapshots.
+
+    Snapshots are keyed by the retrace command (with the contents of any file
+    arguments, such as the trace, replaced by their digest), the environment
+    overrides, and the call number, and are kept as zlib compressed PNMs.  An
+    index of the snapshotted call numbers is saved for every complete run, so
+    that the same call set can later be served entirely from the store.  The
+    least recently used files are evicted when the total size exceeds the
+    budget.
+    '''
+
+    def __init__(self, directory, budget = 4 << 30):
+        self.directory = directory
+        self.budget = budget
+        self.fileDigests = {}
+
+    def fileDigest(self, path):
+        st = os.stat(path)
+        key = os.path.abspath(path), st.st_mtime_ns, st.st_size
+        try:
+            return self.fileDigests[key]
+        except KeyError:
+            pass
+        digest = hashlib.sha1()
+        with open(path, 'rb') as stream:
+            while True:
+                data = stream.read(1 << 20)
+                if not data:
+                    break
+                digest.update(data)
+        digest = digest.hexdigest()
+        self.fileDigests[key] = digest
+        return digest
+
+    def runKey(self, retracer):
+        args = [retracer.retraceExe]
+        for arg in retracer.args:
+            if os.path.isfile(arg):
+                arg = 'file:' + self.fileDigest(arg)
+            args.append(arg)
+        env = []
+        if retracer.env:
+            for name, value in sorted(retracer.env.items()):
+                if os.environ.get(name) != value:
+                    env.append((name, value))
+        return hashlib.sha1(repr((args, env)).encode('utf-8')).hexdigest()
+
+    def _indexPath(self, runKey, call_nos):
+        digest = hashlib.sha1(repr((runKey, call_nos)).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest + '.index')
+
+    def _snapshotPath(self, runKey, callNo):
+        return os.path.join(self.directory, '%s.%u.pnm.z' % (runKey, callNo))
+
+    def loadIndex(self, runKey, call_nos):
+        path = self._indexPath(runKey, call_nos)
+        try:
+            with open(path, 'rt') as stream:
+                callNos = json.load(stream)
+        except (OSError, ValueError):
+            return None
+        for callNo in callNos:
+            if not os.path.exists(self._snapshotPath(runKey, callNo)):
+                return None
+        os.utime(path)
+        return callNos
+
+    def saveIndex(self, runKey, call_nos, callNos):
+        path = self._indexPath(runKey, call_nos)
+        tmpPath = '%s.%u.tmp' % (path, os.getpid())
+        with open(tmpPath, 'wt') as stream:
+            json.dump(callNos, stream)
+        os.replace(tmpPath, path)
+
+    def load(self, runKey, callNo):
+        path = self._snapshotPath(runKey, callNo)
+        try:
+            with open(path, 'rb') as stream:
+                data = zlib.decompress(stream.read())
+        except OSError:
+            return None, None
+        os.utime(path)
+        return PNMReader(io.BytesIO(data)).read()
+
+    def save(self, runKey, callNo, header, data):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._snapshotPath(runKey, callNo)
+        tmpPath = '%s.%u.tmp' % (path, os.getpid())
+        compressor = zlib.compressobj(1)
+        with open(tmpPath, 'wb') as stream:
+            stream.write(compressor.compress(header))
+            stream.write(compressor.compress(data))
+            stream.write(compressor.flush())
+        os.replace(tmpPath, path)
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+
+        total = sum([size for mtime, size, path in entries])
+        for mtime, size, path in entries:
+            if total <= self.budget:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
 
 class Retracer:
 
-    def __init__(self, retraceExe, args, env=None):
+    def __init__(self, retraceExe, args, env=None, store=None, dumpFormat='json'):
         self.retraceExe = retraceExe
         self.args = args
         self.env = env
+        self.store = store
+        self.dumpFormat = dumpFormat
 
     def _retrace(self, args, stdout=subprocess.PIPE):
         cmd = [
@@ -95,86 +316,178 @@ class Retracer:
         return p.returncode
 
     def snapshot(self, call_nos):
+        recorder = None
+        if self.store is not None:
+            runKey = self.store.runKey(self)
+            callNos = self.store.loadIndex(runKey, call_nos)
+            if callNos is not None:
+                sys.stderr.write('using stored snapshots for %s\n' % call_nos)
+                return CachedRun(self.store, runKey, callNos)
+            recorder = SnapshotRecorder(self.store, runKey, call_nos)
+
         process = self._retrace([
             '-s', '-',
             '-S', call_nos,
         ])
-        return RetraceRun(process)
+        return RetraceRun(process, recorder = recorder)
+
+    def _dump_states(self, dump_calls):
+        '''Run retrace with the given -D argument, and yield the state dumps.'''
+
+        args = [
+            '-D', dump_calls,
+        ]
+        if self.dumpFormat == 'ubjson':
+            args.insert(0, '--dump-format=ubjson')
+        p = self._retrace(args)
+        try:
+            if self.dumpFormat == 'ubjson':
+                docs = map(jsondiff.hashTree, ubjson.load_all(p.stdout))
+            else:
+                docs = jsondiff.load_all(p.stdout, digests = True)
+            for state in docs:
+                yield state
+        finally:
+            p.stdout.close()
+            p.wait()
+
+    def dump_states(self, call_nos):
+        '''Get the state dumps at the specified call nos, in a single
+        retrace run, plus another one for the default state (call no 0).'''
+
+        call_nos = sorted(set(call_nos))
+        states = {}
+
+        # -D 0 means the default state, which can't be part of a call set,
+        # and isn't labeled with a call no
+        if call_nos and call_nos[0] == 0:
+            for state in self._dump_states('0'):
+                states[0] = state.get('parameters', {})
+        calls = [str(call_no) for call_no in call_nos if call_no != 0]
+        if calls:
+            for state in self._dump_states(','.join(calls)):
+                states[state['call']] = state.get('parameters', {})
+
+        missing = [call_no for call_no in call_nos if call_no not in states]
+        if missing:
+            raise Exception('no state dumped for call(s) %s' % ', '.join(map(str, missing)))
+        return states
 
     def dump_state(self, call_no):
         '''Get the state dump at the specified call no.'''
 
-        p = self._retrace([
-            '-D', str(call_no),
-        ])
-        state = jsondiff.load(p.stdout)
-        p.wait()
-        return state.get('parameters', {})
+        return self.dump_states([call_no])[call_no]
+
+    def diff_states(self, call_no_pairs, stream, label = ''):
+        '''Compare the state between several pairs of calls.'''
+
+        call_nos = []
+        for ref_call_no, src_call_no in call_no_pairs:
+            call_nos.append(ref_call_no)
+            call_nos.append(src_call_no)
+        states = self.dump_states(call_nos)
+
+        for ref_call_no, src_call_no in call_no_pairs:
+            stream.write('# state from call %u to %u%s\n' % (ref_call_no, src_call_no, label))
+            stream.flush()
+            differ = jsondiff.Differ(stream)
+            differ.visit(states[ref_call_no], states[src_call_no])
+            stream.write('\n')
 
     def diff_state(self, ref_call_no, src_call_no, stream):
         '''Compare the state between two calls.'''
 
-        ref_state = self.dump_state(ref_call_no)
-        src_state = self.dump_state(src_call_no)
+        self.diff_states([(ref_call_no, src_call_no)], stream)
 
-        stream.flush()
-        differ = jsondiff.Differ(stream)
-        differ.visit(ref_state, src_state)
-        stream.write('\n')
 
+_pnm_formats = {
+    # magic: (channels, bytesPerChannel, mode)
+    b'P5': (1, 1, 'L'),
+    b'P6': (3, 1, 'RGB'),
+    b'Pf': (1, 4, 'R'),
+    b'PF': (3, 4, 'RGB'),
+    b'PX': (4, 4, 'RGB'),
+}
 
-def read_pnm(stream):
-    '''Read a PNM from the stream, and return the image object, and the comment.'''
 
-    magic = stream.readline()
-    if not magic:
-        return None, None
-    magic = magic.rstrip()
-    if magic == b'P5':
-        channels = 1
-        bytesPerChannel = 1
-        mode = 'L'
-    elif magic == b'P6':
-        channels = 3
-        bytesPerChannel = 1
-        mode = 'RGB'
-    elif magic == b'Pf':
-        channels = 1
-        bytesPerChannel = 4
-        mode = 'R'
-    elif magic == b'PF':
-        channels = 3
-        bytesPerChannel = 4
-        mode = 'RGB'
-    elif magic == b'PX':
-        channels = 4
-        bytesPerChannel = 4
-        mode = 'RGB'
-    else:
-        raise Exception('Unsupported magic %r' % magic)
-    comment = b''
-    line = stream.readline()
-    while line.startswith(b'#'):
-        comment += line[1:]
+class PNMReader:
+    '''Read consecutive PNMs from a stream.
+
+    Pixel data is read with readinto into a ring of preallocated buffers, which
+    are reused once numBuffers further images have been read.
+    '''
+
+    def __init__(self, stream, numBuffers = 1):
+        self.stream = stream
+        self.buffers = [bytearray() for i in range(numBuffers)]
+        self.index = 0
+
+    def read(self):
+        '''Read a PNM from the stream, and return the image object, and the comment.'''
+
+        stream = self.stream
+
+        magic = stream.readline()
+        if not magic:
+            return None, None
+        magic = magic.rstrip()
+        try:
+            channels, bytesPerChannel, mode = _pnm_formats[magic]
+        except KeyError:
+            raise Exception('Unsupported magic %r' % magic)
+        header = [magic + b'\n']
+        comment = b''
         line = stream.readline()
-    width, height = list(map(int, line.strip().split()))
-    maximum = int(stream.readline().strip())
-    if bytesPerChannel == 1:
-        assert maximum == 255
-    else:
-        assert maximum == 1
-    data = stream.read(height * width * channels * bytesPerChannel)
-    if bytesPerChannel == 4:
-        # Image magic only supports single channel floating point images, so
-        # represent the image as numpy arrays
+        while line.startswith(b'#'):
+            header.append(line)
+            comment += line[1:]
+            line = stream.readline()
+        header.append(line)
+        width, height = list(map(int, line.strip().split()))
+        line = stream.readline()
+        header.append(line)
+        maximum = int(line.strip())
+        if bytesPerChannel == 1:
+            assert maximum == 255
+        else:
+            assert maximum == 1
+
+        size = height * width * channels * bytesPerChannel
+        buf = self.buffers[self.index]
+        if len(buf) < size:
+            # Previous images may still be referring to the old buffer
+            buf = bytearray(size)
+            self.buffers[self.index] = buf
+        self.index = (self.index + 1) % len(self.buffers)
+        data = memoryview(buf)[:size]
+        offset = 0
+        while offset < size:
+            n = stream.readinto(data[offset:])
+            if not n:
+                raise EOFError('truncated PNM image')
+            offset += n
+
+        # Raw PNM, for SnapshotStore
+        self.header = b''.join(header)
+        self.data = data
+
+        if bytesPerChannel == 4:
+            # Image magic only supports single channel floating point images, so
+            # represent the image as numpy arrays
+
+            import numpy
+            pixels = numpy.frombuffer(data, dtype=numpy.float32)
+            pixels = pixels.reshape((height, width, channels))
+            return pixels, comment
+
+        image = Image.frombuffer(mode, (width, height), data, 'raw', mode, 0, 1)
+        return image, comment
 
-        import numpy
-        pixels = numpy.fromstring(data, dtype=numpy.float32)
-        pixels.resize((height, width, channels))
-        return pixels, comment
 
-    image = Image.frombuffer(mode, (width, height), data, 'raw', mode, 0, 1)
-    return image, comment
+def read_pnm(stream):
+    '''Read a PNM from the stream, and return the image object, and the comment.'''
+
+    return PNMReader(stream).read()
 
 
 def dumpNumpyImage(output, pixels, filename):
@@ -197,7 +510,7 @@ def dumpNumpyImage(output, pixels, filename):
                 pixels = numpy.c_[arr, 255*numpy.ones((heigth * width, 3 - channels), numpy.uint8)]
             assert channels == 3
             mode = 'RGB'
-        im = Image.frombuffer(mode, (width, height), pixels.tostring(), 'raw', mode, 0, 1)
+        im = Image.frombuffer(mode, (width, height), pixels.tobytes(), 'raw', mode, 0, 1)
     im.save(filename)
 
     if 0:
@@ -211,6 +524,171 @@ def dumpNumpyImage(output, pixels, filename):
             output.write('\n')
 
 
+def compare_images(refImage, srcImage):
+    '''Compare two snapshots, and return the precision in bits, plus the
+    snapdiff.Comparer used (None for floating point images).'''
+
+    if isinstance(refImage, Image.Image) and isinstance(srcImage, Image.Image):
+        # Using PIL
+        comparer = Comparer(refImage, srcImage)
+        precision = comparer.precision()
+        return precision, comparer
+
+    # Using numpy (for floating point images)
+    # TODO: drop PIL when numpy path becomes general enough
+    import numpy
+    assert not isinstance(refImage, Image.Image)
+    assert not isinstance(srcImage, Image.Image)
+    assert refImage.shape == srcImage.shape
+    diffImage = numpy.square(srcImage - refImage)
+
+    height, width, channels = diffImage.shape
+    square_error = numpy.sum(diffImage)
+    square_error += numpy.finfo(numpy.float32).eps
+    rel_error = square_error / float(height*width*channels)
+    bits = -math.log(rel_error)/math.log(2.0)
+    return bits, None
+
+
+def save_diff(output, prefix, refImage, srcImage, comparer):
+    prefix_dir = os.path.dirname(prefix)
+    if not os.path.isdir(prefix_dir):
+        os.makedirs(prefix_dir)
+    if comparer is None:
+        dumpNumpyImage(output, refImage, prefix + '.ref.png')
+        dumpNumpyImage(output, srcImage, prefix + '.src.png')
+    else:
+        refImage.save(prefix + '.ref.png')
+        srcImage.save(prefix + '.src.png')
+        comparer.write_diff(prefix + '.diff.png')
+
+
+def compare_runs(refRetracer, srcRetracers, call_nos, output, highligher, stop_on_mismatch = False):
+    '''Compare the snapshots of the reference retracer against those of one or
+    more source retracers, at the given call set.
+
+    The reference is replayed only once, and every reference snapshot is
+    compared against all sources.
+
+    Returns the call number of the first mismatching snapshot, and of the last
+    matching snapshot before it (either may be None).
+    '''
+
+    numSrcs = len(srcRetracers)
+    first_bad = None
+    last_bad = [-1] * numSrcs
+    last_good = [0] * numSrcs
+    state_diffs = [[] for i in range(numSrcs)]
+    last_good_before_bad = None
+
+    if numSrcs > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        executor = ThreadPoolExecutor(numSrcs)
+        mapper = executor.map
+    else:
+        executor = None
+        mapper = map
+
+    refRun = refRetracer.snapshot(call_nos)
+    srcRuns = []
+    try:
+        for srcRetracer in srcRetracers:
+            srcRuns.append(srcRetracer.snapshot(call_nos))
+
+        while True:
+            # Get the reference image
+            refImage, refCallNo = refRun.nextSnapshot()
+            if refImage is None:
+                break
+
+            # Get the source images
+            srcImages = []
+            for srcRun in srcRuns:
+                srcImage, srcCallNo = srcRun.nextSnapshot()
+                if srcImage is None:
+                    break
+                assert refCallNo == srcCallNo
+                srcImages.append(srcImage)
+            if len(srcImages) < numSrcs:
+                break
+
+            callNo = refCallNo
+
+            # Compare the images
+            results = list(mapper(compare_images, [refImage] * numSrcs, srcImages))
+
+            any_mismatch = False
+            if numSrcs == 1:
+                # Highlight the whole row
+                precision, comparer = results[0]
+                any_mismatch = precision < options.threshold
+                if any_mismatch:
+                    highligher.color(highligher.red)
+                    highligher.bold()
+                highligher.write('%u\t%f\n' % (callNo, precision))
+                if any_mismatch:
+                    highligher.normal()
+            else:
+                # Highlight the mismatching columns only
+                highligher.write('%u' % callNo)
+                for i in range(numSrcs):
+                    precision, comparer = results[i]
+                    mismatch = precision < options.threshold
+                    highligher.write('\t')
+                    if mismatch:
+                        highligher.color(highligher.red)
+                        highligher.bold()
+                    highligher.write('%f' % precision)
+                    if mismatch:
+                        highligher.normal()
+                    any_mismatch = any_mismatch or mismatch
+                highligher.write('\n')
+
+            for i in range(numSrcs):
+                precision, comparer = results[i]
+                mismatch = precision < options.threshold
+                if mismatch:
+                    if options.diff_prefix:
+                        if numSrcs > 1:
+                            prefix = os.path.join(options.diff_prefix, 'src%u' % i, '%010u' % callNo)
+                        else:
+                            prefix = os.path.join(options.diff_prefix, '%010u' % callNo)
+                        save_diff(output, prefix, refImage, srcImages[i], comparer)
+                    if last_bad[i] < last_good[i] and options.diff_state:
+                        state_diffs[i].append((last_good[i], callNo))
+                    last_bad[i] = callNo
+                else:
+                    last_good[i] = callNo
+
+            if any_mismatch:
+                if first_bad is None:
+                    first_bad = callNo
+            elif first_bad is None:
+                last_good_before_bad = callNo
+
+            highligher.flush()
+
+            if any_mismatch and stop_on_mismatch:
+                break
+    finally:
+        for srcRun in srcRuns:
+            srcRun.terminate()
+        refRun.terminate()
+        if executor is not None:
+            executor.shutdown()
+
+    # Dump all states needed in one replay per source
+    for i in range(numSrcs):
+        if state_diffs[i]:
+            if numSrcs > 1:
+                label = ' (src%u)' % i
+            else:
+                label = ''
+            srcRetracers[i].diff_states(state_diffs[i], output, label)
+
+    return first_bad, last_good_before_bad
+
+
 def parse_env(optparser, entries):
     '''Translate a list of NAME=VALUE entries into an environment dictionary.'''
 
@@ -227,6 +705,24 @@ def parse_env(optparser, entries):
     return env
 
 
+def parse_config(optparser, config):
+    '''Split a source configuration string into retrace arguments, and
+    NAME=VALUE environment entries.'''
+
+    args = []
+    env = []
+    try:
+        tokens = shlex.split(config)
+    except ValueError as ex:
+        optparser.error('invalid source configuration %r: %s' % (config, ex))
+    for token in tokens:
+        if not token.startswith('-') and '=' in token:
+            env.append(token)
+        else:
+            args.append(token)
+    return args, env
+
+
 def main():
     '''Main program.
     '''
@@ -257,6 +753,10 @@ def main():
         '--src-arg', metavar='OPTION',
         type='string', action='append', dest='src_args', default=[],
         help='pass argument to source retrace')
+    optparser.add_option(
+        '--src-config', metavar='CONFIG',
+        type='string', action='append', dest='src_configs', default=[],
+        help='source configuration, as NAME=VALUE environment entries and retrace options; may be repeated to compare several configurations against a single reference replay')
     optparser.add_option(
         '--ref-env', metavar='NAME=VALUE',
         type='string', action='append', dest='ref_env', default=[],
@@ -265,6 +765,14 @@ def main():
         '--src-env', metavar='NAME=VALUE',
         type='string', action='append', dest='src_env', default=[],
         help='add variable to source environment')
+    optparser.add_option(
+        '--ref-store', metavar='DIR',
+        type='string', dest='ref_store', default=None,
+        help='store reference snapshots in DIR, and reuse them on later runs')
+    optparser.add_option(
+        '--ref-store-size', metavar='MB',
+        type='int', dest='ref_store_size', default=4096,
+        help='maximum size of the reference snapshot store [default: %default]')
     optparser.add_option(
         '--diff-prefix', metavar='PATH',
         type='string', dest='diff_prefix', default='.',
@@ -277,10 +785,18 @@ def main():
         '-S', '--snapshot-frequency', metavar='CALLSET',
         type="string", dest="snapshot_frequency", default='draw',
         help="calls to compare [default: %default]")
+    optparser.add_option(
+        '--bisect',
+        action='store_true', dest='bisect', default=False,
+        help='only compare frames until the first mismatch, then the draws within that frame')
     optparser.add_option(
         '--diff-state',
         action='store_true', dest='diff_state', default=False,
         help='diff state between failing calls')
+    optparser.add_option(
+        '--dump-format', metavar='FORMAT',
+        type='choice', choices=('json', 'ubjson'), dest='dump_format', default='json',
+        help='state dump format to request from retrace (json or ubjson) [default: %default]')
     optparser.add_option(
         '-o', '--output', metavar='FILE',
         type="string", dest="output",
@@ -297,8 +813,24 @@ def main():
     if options.src_driver:
         options.src_args.insert(0, '--driver=' + options.src_driver)
 
-    refRetracer = Retracer(options.retrace, options.ref_args + args, ref_env)
-    srcRetracer = Retracer(options.retrace, options.src_args + args, src_env)
+    if options.ref_store:
+        store = SnapshotStore(options.ref_store, options.ref_store_size << 20)
+    else:
+        store = None
+
+    refRetracer = Retracer(options.retrace, options.ref_args + args, ref_env, store)
+    if options.src_configs:
+        if options.bisect:
+            optparser.error('--bisect is not supported with --src-config')
+        srcRetracers = []
+        for src_config in options.src_configs:
+            config_args, config_env = parse_config(optparser, src_config)
+            srcRetracers.append(Retracer(options.retrace, options.src_args + config_args + args,
+                                         parse_env(optparser, options.src_env + config_env),
+                                         dumpFormat=options.dump_format))
+    else:
+        srcRetracers = [Retracer(options.retrace, options.src_args + args, src_env,
+                                 dumpFormat=options.dump_format)]
 
     if options.output:
         output = open(options.output, 'wt')
@@ -307,84 +839,23 @@ def main():
 
     highligher = AutoHighlighter(output)
 
-    highligher.write('call\tprecision\n')
-
-    last_bad = -1
-    last_good = 0
-    refRun = refRetracer.snapshot(options.snapshot_frequency)
-    try:
-        srcRun = srcRetracer.snapshot(options.snapshot_frequency)
-        try:
-            while True:
-                # Get the reference image
-                refImage, refCallNo = refRun.nextSnapshot()
-                if refImage is None:
-                    break
-
-                # Get the source image
-                srcImage, srcCallNo = srcRun.nextSnapshot()
-                if srcImage is None:
-                    break
-
-                assert refCallNo == srcCallNo
-                callNo = refCallNo
-
-                # Compare the two images
-                if isinstance(refImage, Image.Image) and isinstance(srcImage, Image.Image):
-                    # Using PIL
-                    numpyImages = False
-                    comparer = Comparer(refImage, srcImage)
-                    precision = comparer.precision()
-                else:
-                    # Using numpy (for floating point images)
-                    # TODO: drop PIL when numpy path becomes general enough
-                    import numpy
-                    assert not isinstance(refImage, Image.Image)
-                    assert not isinstance(srcImage, Image.Image)
-                    numpyImages = True
-                    assert refImage.shape == srcImage.shape
-                    diffImage = numpy.square(srcImage - refImage)
-
-                    height, width, channels = diffImage.shape
-                    square_error = numpy.sum(diffImage)
-                    square_error += numpy.finfo(numpy.float32).eps
-                    rel_error = square_error / float(height*width*channels)
-                    bits = -math.log(rel_error)/math.log(2.0)
-                    precision = bits
-
-                mismatch = precision < options.threshold
-
-                if mismatch:
-                    highligher.color(highligher.red)
-                    highligher.bold()
-                highligher.write('%u\t%f\n' % (callNo, precision))
-                if mismatch:
-                    highligher.normal()
-
-                if mismatch:
-                    if options.diff_prefix:
-                        prefix = os.path.join(options.diff_prefix, '%010u' % callNo)
-                        prefix_dir = os.path.dirname(prefix)
-                        if not os.path.isdir(prefix_dir):
-                            os.makedirs(prefix_dir)
-                        if numpyImages:
-                            dumpNumpyImage(output, refImage, prefix + '.ref.png')
-                            dumpNumpyImage(output, srcImage, prefix + '.src.png')
-                        else:
-                            refImage.save(prefix + '.ref.png')
-                            srcImage.save(prefix + '.src.png')
-                            comparer.write_diff(prefix + '.diff.png')
-                    if last_bad < last_good and options.diff_state:
-                        srcRetracer.diff_state(last_good, callNo, output)
-                    last_bad = callNo
-                else:
-                    last_good = callNo
-
-                highligher.flush()
-        finally:
-            srcRun.terminate()
-    finally:
-        refRun.terminate()
+    if options.src_configs:
+        for i in range(len(options.src_configs)):
+            highligher.write('# src%u: %s\n' % (i, options.src_configs[i]))
+        highligher.write('call\t' + '\t'.join(['src%u' % i for i in range(len(options.src_configs))]) + '\n')
+    else:
+        highligher.write('call\tprecision\n')
+
+    if options.bisect:
+        # Find the first mismatching frame
+        first_bad, last_good = compare_runs(refRetracer, srcRetracers, 'frame', output, highligher, True)
+        if first_bad is not None:
+            # Narrow down to the first mismatching draw within that frame
+            start = 0 if last_good is None else last_good + 1
+            call_nos = '%u-%u/draw,%u' % (start, first_bad, first_bad)
+            compare_runs(refRetracer, srcRetracers, call_nos, output, highligher, True)
+    else:
+        compare_runs(refRetracer, srcRetracers, options.snapshot_frequency, output, highligher)
 
 
 if __name__ == '__main__':
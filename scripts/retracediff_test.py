@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+##########################################################################
+#
+# Copyright 2026 The apitrace authors
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+##########################################################################/
+
+
+'''Tests for retracediff.py, against a fake retrace program.'''
+
+
+import os.path
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import unittest
+
+
+_scriptsDir = os.path.dirname(os.path.abspath(__file__))
+
+
+# Fake retrace, whose snapshots and state change from call FAKE_BAD onwards.
+# -D follows retrace_main.cpp: a lone 0 dumps the default state, without a
+# call no, while call 0 can't be dumped as part of a call set.
+_fakeRetrace = r'''
+import os
+import sys
+
+args = sys.argv[1:]
+bad = int(os.environ.get('FAKE_BAD', '1000000'))
+
+def callSet(arg):
+    callNos = set()
+    for part in arg.split(','):
+        first, sep, last = part.partition('-')
+        callNos.update(range(int(first), int(last or first) + 1))
+    return callNos
+
+out = sys.stdout.buffer
+if '-D' in args:
+    arg = args[args.index('-D') + 1]
+    if arg == '0':
+        out.write(b'{"parameters": {"GL_BAD": 0}}\n')
+        sys.exit(0)
+    callNos = sorted(callSet(arg))
+    if 0 in callNos:
+        sys.exit(1)
+    for callNo in callNos:
+        out.write(b'{"call": %u, "parameters": {"GL_BAD": %u}}\n' % (callNo, callNo >= bad))
+elif '-S' in args:
+    for callNo in sorted(callSet(args[args.index('-S') + 1])):
+        value = 255 if callNo >= bad else 0
+        out.write(b'P6\n#%u\n4 4\n255\n' % callNo + bytes([value, 0, 0]) * 16)
+'''
+
+
+class RetraceDiffTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp(prefix='retracediff-test-')
+        self.retrace = os.path.join(self.tmpDir, 'retrace')
+        with open(self.retrace, 'wt') as stream:
+            stream.write('#!%s\n' % sys.executable)
+            stream.write(_fakeRetrace)
+        os.chmod(self.retrace, os.stat(self.retrace).st_mode | stat.S_IXUSR)
+        self.trace = os.path.join(self.tmpDir, 'fake.trace')
+        open(self.trace, 'wb').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def retraceDiff(self, *args):
+        cmd = [
+            sys.executable, os.path.join(_scriptsDir, 'retracediff.py'),
+            '-r', self.retrace,
+            '--diff-prefix', os.path.join(self.tmpDir, 'diff'),
+        ] + list(args) + [self.trace]
+        return subprocess.check_output(cmd, stderr=subprocess.DEVNULL, universal_newlines=True)
+
+    def testDiffStateFirstSnapshot(self):
+        # The first snapshot mismatches, so the state is compared against
+        # the default state
+        output = self.retraceDiff('-S', '3,6', '--diff-state', '--src-env', 'FAKE_BAD=3')
+        self.assertIn('# state from call 0 to 3\n', output)
+        self.assertIn('GL_BAD', output)
+
+    def testDiffStateLaterSnapshot(self):
+        output = self.retraceDiff('-S', '3,6,9', '--diff-state', '--src-env', 'FAKE_BAD=6')
+        self.assertIn('# state from call 3 to 6\n', output)
+        self.assertIn('GL_BAD', output)
+        self.assertNotIn('# state from call 0', output)
+
+
+if __name__ == '__main__':
+    unittest.main()
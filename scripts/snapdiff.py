@@ -30,6 +30,8 @@
 '''
 
 
+import io
+import itertools
 import sys
 import os.path
 import optparse
@@ -48,7 +50,11 @@ thumbSize = 320
 gaussian_kernel = ImageFilter.Kernel((3, 3), [1, 2, 1, 2, 4, 2, 1, 2, 1], 16)
 
 class Comparer:
-    '''Image comparer.'''
+    '''Image comparer.
+
+    Identical images are detected upfront by comparing the raw pixel buffers,
+    in which case the difference image is never computed.
+    '''
 
     def __init__(self, ref_image, src_image, alpha = False):
         if isinstance(ref_image, str):
@@ -66,7 +72,18 @@ class Comparer:
             self.ref_im = self.ref_im.convert('RGB')
             self.src_im = self.src_im.convert('RGB')
 
-        self.diff = ImageChops.difference(self.src_im, self.ref_im)
+        self.identical = \
+            self.ref_im.size == self.src_im.size and \
+            self.ref_im.mode == self.src_im.mode and \
+            self.ref_im.tobytes() == self.src_im.tobytes()
+
+        self._diff = None
+
+    @property
+    def diff(self):
+        if self._diff is None:
+            self._diff = ImageChops.difference(self.src_im, self.ref_im)
+        return self._diff
 
     def size_mismatch(self):
         return self.ref_im.size != self.src_im.size
@@ -98,27 +115,44 @@ class Comparer:
         if self.size_mismatch():
             return 0.0
 
-        diff = self.diff
-        if filter:
-            diff = diff.filter(gaussian_kernel)
+        width, height = self.ref_im.size
 
-        # See also http://effbot.org/zone/pil-comparing-images.htm
-        h = diff.histogram()
-        square_error = 0
-        for i in range(1, 256):
-            square_error += sum(h[i : 3*256: 256])*i*i
-        rel_error = float(square_error*2 + 1) / float(self.diff.size[0]*self.diff.size[1]*3*255*255*2)
+        if self.identical:
+            square_error = 0
+        else:
+            diff = self.diff
+            if filter:
+                diff = diff.filter(gaussian_kernel)
+
+            # See also http://effbot.org/zone/pil-comparing-images.htm
+            h = diff.histogram()
+            square_error = 0
+            for i in range(1, 256):
+                square_error += sum(h[i : 3*256: 256])*i*i
+        rel_error = float(square_error*2 + 1) / float(width*height*3*255*255*2)
         bits = -math.log(rel_error)/math.log(2.0)
         return bits
 
-    def ae(self, fuzz = 0.05):
-        # Compute absolute error
+    def ae(self, fuzz = 0.05, per_channel = True):
+        '''Compute absolute error, as the number of pixels whose error exceeds
+        255*fuzz.
+
+        By default the maximum error across all channels is used, which
+        matches the pixels highlighted by write_diff; otherwise the error is
+        measured on the grayscale conversion of the difference, as older
+        versions did, which is only an approximation.'''
 
         if self.size_mismatch():
             return sys.maxsize
 
-        # TODO: this is approximate due to the grayscale conversion
-        h = self.diff.convert('L').histogram()
+        if self.identical:
+            return 0
+
+        if per_channel:
+            diff = reduce(ImageChops.lighter, self.diff.split())
+        else:
+            diff = self.diff.convert('L')
+        h = diff.histogram()
         ae = sum(h[int(255 * fuzz) + 1 : 256])
         return ae
 
@@ -175,6 +209,48 @@ def find_images(prefix):
     return images
 
 
+def compare_image(image, ref_prefix, src_prefix, options):
+    '''Compare one image, writing the difference image and thumbnails as
+    needed, and return the comparison result and the HTML table row.'''
+
+    html = io.StringIO()
+
+    ref_image = ref_prefix + image
+    src_image = src_prefix + image
+    root, ext = os.path.splitext(src_image)
+    delta_image = "%s.diff.png" % (root, )
+    if os.path.exists(ref_image) and os.path.exists(src_image):
+        comparer = Comparer(ref_image, src_image, options.alpha)
+        match = comparer.ae(fuzz=options.fuzz, per_channel=not options.grayscale) == 0
+        if match:
+            result = 'MATCH'
+            bgcolor = '#20ff20'
+        else:
+            result = 'MISMATCH'
+            bgcolor = '#ff2020'
+    else:
+        comparer = None
+        match = None
+        result = 'MISSING'
+        bgcolor = '#ff2020'
+
+    html.write('      <tr>\n')
+    html.write('        <td bgcolor="%s"><a href="%s">%s<a/></td>\n' % (bgcolor, ref_image, image))
+    if not match or options.show_all:
+        if comparer is not None \
+           and (options.overwrite \
+                or not os.path.exists(delta_image) \
+                 or (os.path.getmtime(delta_image) < os.path.getmtime(ref_image) \
+                     and os.path.getmtime(delta_image) < os.path.getmtime(src_image))):
+                comparer.write_diff(delta_image, fuzz=options.fuzz)
+        surface(html, ref_image)
+        surface(html, src_image)
+        surface(html, delta_image)
+    html.write('      </tr>\n')
+
+    return image, result, html.getvalue()
+
+
 def main():
     global options
 
@@ -192,6 +268,10 @@ def main():
         '-f', '--fuzz',
         type="float", dest="fuzz", default=0.05,
         help="fuzz ratio [default: %default]")
+    optparser.add_option(
+        '--grayscale',
+        action="store_true", dest="grayscale", default=False,
+        help="measure the error on the grayscale difference, as older versions did")
     optparser.add_option(
         '-a', '--alpha',
         action="store_true", dest="alpha", default=False,
@@ -204,6 +284,10 @@ def main():
         '--show-all',
         action="store_true", dest="show_all", default=False,
         help="show all images, including similar ones")
+    optparser.add_option(
+        '-j', '--jobs', metavar='JOBS',
+        type="int", dest="jobs", default=os.cpu_count() or 1,
+        help="number of images to compare in parallel [default: %default]")
 
     (options, args) = optparser.parse_args(sys.argv[1:])
 
@@ -226,47 +310,35 @@ def main():
     html.write('  <body>\n')
     html.write('    <table border="1">\n')
     html.write('      <tr><th>File</th><th>%s</th><th>%s</th><th>&Delta;</th></tr>\n' % (ref_prefix, src_prefix))
+
+    if options.jobs > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(options.jobs)
+        results = executor.map(compare_image, images,
+                               itertools.repeat(ref_prefix),
+                               itertools.repeat(src_prefix),
+                               itertools.repeat(options),
+                               chunksize=16)
+    else:
+        executor = None
+        results = map(compare_image, images,
+                      itertools.repeat(ref_prefix),
+                      itertools.repeat(src_prefix),
+                      itertools.repeat(options))
+
+    # Results come back in the same (sorted) order as the images
     failures = 0
-    for image in images:
-        ref_image = ref_prefix + image
-        src_image = src_prefix + image
-        root, ext = os.path.splitext(src_image)
-        delta_image = "%s.diff.png" % (root, )
-        if os.path.exists(ref_image) and os.path.exists(src_image):
-            if options.verbose:
-                sys.stdout.write('Comparing %s and %s ...' % (ref_image, src_image))
-            comparer = Comparer(ref_image, src_image, options.alpha)
-            match = comparer.ae(fuzz=options.fuzz) == 0
-            if match:
-                result = 'MATCH'
-                bgcolor = '#20ff20'
-            else:
-                result = 'MISMATCH'
-                failures += 1
-                bgcolor = '#ff2020'
-        else:
-            comparer = None
-            match = None
-            result = 'MISSING'
+    for image, result, row in results:
+        if result != 'MATCH':
             failures += 1
-            bgcolor = '#ff2020'
-
         if options.verbose:
-            sys.stdout.write(' %s\n' % (result,))
-        html.write('      <tr>\n')
-        html.write('        <td bgcolor="%s"><a href="%s">%s<a/></td>\n' % (bgcolor, ref_image, image))
-        if not match or options.show_all:
-            if comparer is not None \
-               and (options.overwrite \
-                    or not os.path.exists(delta_image) \
-                     or (os.path.getmtime(delta_image) < os.path.getmtime(ref_image) \
-                         and os.path.getmtime(delta_image) < os.path.getmtime(src_image))):
-                    comparer.write_diff(delta_image, fuzz=options.fuzz)
-            surface(html, ref_image)
-            surface(html, src_image)
-            surface(html, delta_image)
-        html.write('      </tr>\n')
+            sys.stdout.write('Comparing %s%s and %s%s ... %s\n' % (ref_prefix, image, src_prefix, image, result))
+        html.write(row)
         html.flush()
+
+    if executor is not None:
+        executor.shutdown()
+
     html.write('    </table>\n')
     html.write('  </body>\n')
     html.write('</html>\n')
@@ -25,7 +25,9 @@
 ##########################################################################/
 
 
+import bisect
 import difflib
+import hashlib
 import itertools
 import optparse
 import os.path
@@ -198,7 +200,8 @@ class ExternalDiffer(Differ):
 # Python diff
 #
 
-from unpickle import Unpickler, Dumper, Rebuilder
+from unpickle import Unpickler, Dumper, Rebuilder, CALL_FLAG_END_FRAME
+from unpickle import addCacheOptions, getCache, openTrace
 from highlight import PlainHighlighter, LessHighlighter
 
 
@@ -214,9 +217,24 @@ ignoredFunctionNames = set([
 ])
 
 
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+def blobDigest(data):
+    '''Fast 64-bit content digest of the raw bytes.'''
+    if xxhash is not None:
+        return xxhash.xxh3_64_intdigest(data)
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little')
+
+
 class Blob:
     '''Data-less proxy for bytes, to save memory.'''
 
+    __slots__ = ('size', 'hash')
+
     def __init__(self, size, hash):
         self.size = size
         self.hash = hash
@@ -225,35 +243,184 @@ class Blob:
         return 'blob(%u)' % self.size
 
     def __eq__(self, other):
-        return isinstance(other, Blob) and self.size == other.size and self.hash == other.hash
+        return self is other or \
+            isinstance(other, Blob) and self.size == other.size and self.hash == other.hash
 
     def __hash__(self):
         return self.hash
 
 
 class BlobReplacer(Rebuilder):
-    '''Replace blobs with proxys.'''
+    '''Replace blobs with proxys.
+
+    Proxies are interned by (size, digest), so identical uploads share a
+    single proxy, across all the traces visited by the same replacer, until
+    it's cleared.
+    '''
+
+    def __init__(self):
+        Rebuilder.__init__(self)
+        self.blobs = {}
 
     def visitBytes(self, obj):
-        return Blob(len(obj), hash(str(obj)))
+        key = len(obj), blobDigest(obj)
+        try:
+            return self.blobs[key]
+        except KeyError:
+            blob = Blob(*key)
+            self.blobs[key] = blob
+            return blob
 
     def visitCall(self, call):
         call.args = list(map(self.visit, call.args))
         call.ret = self.visit(call.ret)
 
+    def clear(self):
+        self.blobs.clear()
+
 
 class Loader(Unpickler):
 
-    def __init__(self, stream):
+    def __init__(self, stream, rebuilder = None):
         Unpickler.__init__(self, stream)
         self.calls = []
-        self.rebuilder = BlobReplacer()
+        if rebuilder is None:
+            rebuilder = BlobReplacer()
+        self.rebuilder = rebuilder
 
     def handleCall(self, call):
         if call.functionName not in ignoredFunctionNames:
             self.rebuilder.visitCall(call)
             self.calls.append(call)
 
+    def iterFrames(self):
+        '''Generator yielding the calls one frame at a time.'''
+
+        frame = []
+        for call in self.iterCalls():
+            if call.functionName not in ignoredFunctionNames:
+                self.rebuilder.visitCall(call)
+                frame.append(call)
+            if call.flags & CALL_FLAG_END_FRAME:
+                yield frame
+                frame = []
+        if frame:
+            yield frame
+
+
+def _patienceMatches(a, alo, ahi, b, blo, bhi, isjunk, matches):
+    '''Append the (i, j) pairs of matching elements of a[alo:ahi] and
+    b[blo:bhi] to matches, using patience diff.'''
+
+    # Ranges between anchors nest arbitrarily deep, so rather than recursing
+    # keep a stack of the ranges still to match, interleaved with the lists
+    # of matches to emit after them, in reverse order.
+    stack = [(alo, ahi, blo, bhi)]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, list):
+            matches.extend(item)
+            continue
+        alo, ahi, blo, bhi = item
+
+        # Match common prefix
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            matches.append((alo, blo))
+            alo += 1
+            blo += 1
+
+        # Match common suffix
+        suffix = []
+        while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+            suffix.append((ahi, bhi))
+        suffix.reverse()
+        stack.append(suffix)
+
+        if alo >= ahi or blo >= bhi:
+            continue
+
+        # Find the elements occurring exactly once in each side
+        counts = {}
+        for i in range(alo, ahi):
+            x = a[i]
+            if isjunk is not None and isjunk(x):
+                continue
+            entry = counts.get(x)
+            if entry is None:
+                counts[x] = [1, i, 0, None]
+            else:
+                entry[0] += 1
+        for j in range(blo, bhi):
+            entry = counts.get(b[j])
+            if entry is not None:
+                entry[2] += 1
+                entry[3] = j
+        pairs = [(entry[1], entry[3]) for entry in counts.values() if entry[0] == 1 and entry[2] == 1]
+        pairs.sort()
+
+        if pairs:
+            # Longest increasing subsequence on b, via patience sorting
+            tails = []
+            piles = []
+            backPointers = []
+            for i, j in pairs:
+                k = bisect.bisect_left(tails, j)
+                if k == len(tails):
+                    tails.append(j)
+                    piles.append(len(backPointers))
+                else:
+                    tails[k] = j
+                    piles[k] = len(backPointers)
+                backPointers.append((i, j, piles[k - 1] if k else None))
+            anchors = []
+            index = piles[-1]
+            while index is not None:
+                i, j, index = backPointers[index]
+                anchors.append((i, j))
+
+            # Match between the anchors, last range first
+            for i, j in anchors:
+                stack.append((i + 1, ahi, j + 1, bhi))
+                stack.append([(i, j)])
+                ahi = i
+                bhi = j
+            stack.append((alo, ahi, blo, bhi))
+        else:
+            # No unique elements -- fall back to difflib
+            matcher = difflib.SequenceMatcher(isjunk, a[alo:ahi], b[blo:bhi], autojunk=False)
+            for i, j, n in matcher.get_matching_blocks():
+                for k in range(n):
+                    matches.append((alo + i + k, blo + j + k))
+
+
+def patienceOpcodes(a, b, isjunk=None):
+    '''Same as difflib.SequenceMatcher(isjunk, a, b).get_opcodes(), but
+    using the patience diff algorithm.'''
+
+    matches = []
+    _patienceMatches(a, 0, len(a), b, 0, len(b), isjunk, matches)
+
+    opcodes = []
+    i = j = 0
+    for ai, bj in matches + [(len(a), len(b))]:
+        if i < ai and j < bj:
+            opcodes.append(('replace', i, ai, j, bj))
+        elif i < ai:
+            opcodes.append(('delete', i, ai, j, j))
+        elif j < bj:
+            opcodes.append(('insert', i, i, j, bj))
+        if ai < len(a) and bj < len(b):
+            if opcodes and opcodes[-1][0] == 'equal':
+                tag, alo, ahi, blo, bhi = opcodes[-1]
+                opcodes[-1] = (tag, alo, ai + 1, blo, bj + 1)
+            else:
+                opcodes.append(('equal', ai, ai + 1, bj, bj + 1))
+        i = ai + 1
+        j = bj + 1
+    return opcodes
+
 
 class PythonDiffer(Differ):
 
@@ -272,38 +439,78 @@ class PythonDiffer(Differ):
         self.aSpace = 0
         self.bSpace = 0
         self.dumper = Dumper()
+        self.frames = options.frames
+        self.blobReplacer = BlobReplacer()
+        self.cache = getCache(options)
 
     def setRefTrace(self, refTrace, ref_calls):
-        self.a = self.readTrace(refTrace, ref_calls)
+        if self.frames:
+            self.aFrames = self.readFrames(refTrace, ref_calls)
+        else:
+            self.a = self.readTrace(refTrace, ref_calls)
 
     def setSrcTrace(self, srcTrace, src_calls):
-        self.b = self.readTrace(srcTrace, src_calls)
+        if self.frames:
+            self.bFrames = self.readFrames(srcTrace, src_calls)
+        else:
+            self.b = self.readTrace(srcTrace, src_calls)
 
     def readTrace(self, trace, calls):
-        p = subprocess.Popen(
-            args = [
-                self.apitrace,
-                'pickle',
-                '--symbolic',
-                '--calls=' + calls,
-                trace
-            ],
-            stdout=subprocess.PIPE,
-        )
-
-        parser = Loader(p.stdout)
+        parser = self.openTrace(trace, calls)
         parser.parse()
         return parser.calls
 
+    def readFrames(self, trace, calls):
+        parser = self.openTrace(trace, calls)
+        return parser.iterFrames()
+
+    def openTrace(self, trace, calls):
+        stream = openTrace(self.apitrace, trace, ['--symbolic', '--hash', '--calls=' + calls], self.cache)
+        return Loader(stream, self.blobReplacer)
+
     def diff(self):
         try:
-            self._diff()
+            if self.frames:
+                self._diffFrames()
+            else:
+                self._diff()
         except IOError:
             pass
 
     def _diff(self):
-        matcher = difflib.SequenceMatcher(self.isjunk, self.a, self.b)
-        for tag, alo, ahi, blo, bhi in matcher.get_opcodes():
+        a, b, isjunk = self.alignmentKeys(self.a, self.b)
+        matcher = difflib.SequenceMatcher(isjunk, a, b)
+        self._diffOpcodes(matcher.get_opcodes())
+
+    def _diffFrames(self):
+        # Only one frame of each trace is held in memory at a time
+        for a, b in itertools.zip_longest(self.aFrames, self.bFrames, fillvalue=[]):
+            self.a = a
+            self.b = b
+            a, b, isjunk = self.alignmentKeys(a, b)
+            self._diffOpcodes(patienceOpcodes(a, b, isjunk))
+            # Don't keep the blobs of past frames alive either
+            self.blobReplacer.clear()
+
+    def alignmentKeys(self, a, b):
+        '''Return the sequences and junk predicate to align.
+
+        When every call has a digest precomputed by `apitrace pickle --hash`,
+        align the digests instead of the calls, so that no Python level hashing
+        or comparison is done.
+        '''
+
+        for call in itertools.chain(a, b):
+            if call.digest is None:
+                return a, b, self.isjunk
+
+        junk = set([call.digest for call in itertools.chain(a, b) if self.isjunk(call)])
+        aKeys = [call.digest for call in a]
+        bKeys = [call.digest for call in b]
+        return aKeys, bKeys, junk.__contains__
+
+    def _diffOpcodes(self, opcodes):
+        for tag, alo, ahi, blo, bhi in opcodes:
             if tag == 'replace':
                 self.replace(alo, ahi, blo, bhi)
             elif tag == 'delete':
@@ -520,8 +727,8 @@ def main():
         help="diff tool: diff, sdiff, wdiff, or python [default: auto]")
     optparser.add_option(
         '-c', '--calls', metavar='CALLSET',
-        type="string", dest="calls", default='0-10000',
-        help="calls to compare [default: %default]")
+        type="string", dest="calls", default=None,
+        help="calls to compare [default: 0-10000, or all calls with --frames]")
     optparser.add_option(
         '--ref-calls', metavar='CALLSET',
         type="string", dest="refCalls", default=None,
@@ -540,15 +747,27 @@ def main():
         action="store_true",
         dest="suppressCommonLines", default=False,
         help="do not output common lines")
+    optparser.add_option(
+        '--frames',
+        action="store_true",
+        dest="frames", default=False,
+        help="align traces frame by frame, with bounded memory (python tool only)")
     optparser.add_option(
         '-w', '--width', metavar='NUM',
         type="int", dest="width",
         help="columns [default: auto]")
+    addCacheOptions(optparser)
 
     (options, args) = optparser.parse_args(sys.argv[1:])
     if len(args) != 2:
         optparser.error("incorrect number of arguments")
 
+    if options.frames:
+        if options.tool is None:
+            options.tool = 'python'
+        elif options.tool != 'python':
+            optparser.error('--frames requires the python tool')
+
     if options.tool is None:
         if platform.system() == 'Windows':
             options.tool = 'python'
@@ -563,6 +782,12 @@ def main():
                     sys.stderr.write('warning: sdiff not found\n')
                     options.tool = 'diff'
 
+    if options.calls is None:
+        # Frame by frame memory is bounded, so don't cut the diff short
+        if options.frames:
+            options.calls = '*'
+        else:
+            options.calls = '0-10000'
     if options.refCalls is None:
         options.refCalls = options.calls
     if options.srcCalls is None:
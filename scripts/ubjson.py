@@ -0,0 +1,234 @@
+##########################################################################
+#
+# Copyright 2026 The apitrace authors
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+##########################################################################/
+
+
+'''UBJSON decoder for the state dumps written by `glretrace --dump-format=ubjson`.
+
+Values decode as they would from the equivalent JSON dump, except that binary
+blobs (strongly typed uint8 arrays) are returned as memoryviews into the
+input buffer, rather than being copied.
+
+See also http://ubjson.org/ and lib/ubjson/ubjson.hpp .
+'''
+
+
+import struct
+
+
+MARKER_NULL           = ord('Z')
+MARKER_NOOP           = ord('N')
+MARKER_TRUE           = ord('T')
+MARKER_FALSE          = ord('F')
+MARKER_INT8           = ord('i')
+MARKER_UINT8          = ord('U')
+MARKER_INT16          = ord('I')
+MARKER_INT32          = ord('l')
+MARKER_INT64          = ord('L')
+MARKER_FLOAT32        = ord('d')
+MARKER_FLOAT64        = ord('D')
+MARKER_HIGH_PRECISION = ord('H')
+MARKER_CHAR           = ord('C')
+MARKER_STRING         = ord('S')
+MARKER_ARRAY_BEGIN    = ord('[')
+MARKER_ARRAY_END      = ord(']')
+MARKER_OBJECT_BEGIN   = ord('{')
+MARKER_OBJECT_END     = ord('}')
+MARKER_TYPE           = ord('$')
+MARKER_COUNT          = ord('#')
+
+
+# Fixed size values, as marker: struct
+_structs = {
+    MARKER_INT8: struct.Struct('>b'),
+    MARKER_UINT8: struct.Struct('>B'),
+    MARKER_INT16: struct.Struct('>h'),
+    MARKER_INT32: struct.Struct('>i'),
+    MARKER_INT64: struct.Struct('>q'),
+    MARKER_FLOAT32: struct.Struct('>f'),
+    MARKER_FLOAT64: struct.Struct('>d'),
+}
+
+
+class Decoder:
+
+    def __init__(self, data, strip_images = True):
+        self.data = memoryview(data).cast('B')
+        self.pos = 0
+        self.strip_images = strip_images
+
+    def _error(self, msg):
+        raise ValueError('%s at offset %u' % (msg, self.pos))
+
+    def _readMarker(self):
+        data = self.data
+        while True:
+            try:
+                marker = data[self.pos]
+            except IndexError:
+                self._error('unexpected end of data')
+            self.pos += 1
+            if marker != MARKER_NOOP:
+                return marker
+
+    def _readFixed(self, marker):
+        s = _structs[marker]
+        value, = s.unpack_from(self.data, self.pos)
+        self.pos += s.size
+        return value
+
+    def _readSize(self, marker = None):
+        if marker is None:
+            marker = self._readMarker()
+        if marker not in (MARKER_INT8, MARKER_UINT8, MARKER_INT16, MARKER_INT32, MARKER_INT64):
+            self._error('expected size')
+        size = self._readFixed(marker)
+        if size < 0:
+            self._error('negative size')
+        return size
+
+    def _readBytes(self, size):
+        end = self.pos + size
+        if end > len(self.data):
+            self._error('unexpected end of data')
+        view = self.data[self.pos:end]
+        self.pos = end
+        return view
+
+    def _readString(self, marker = None):
+        return str(self._readBytes(self._readSize(marker)), 'utf-8', 'replace')
+
+    def readValue(self, marker = None):
+        if marker is None:
+            marker = self._readMarker()
+        if marker in _structs:
+            return self._readFixed(marker)
+        elif marker == MARKER_STRING:
+            return self._readString()
+        elif marker == MARKER_OBJECT_BEGIN:
+            return self._readObject()
+        elif marker == MARKER_ARRAY_BEGIN:
+            return self._readArray()
+        elif marker == MARKER_NULL:
+            return None
+        elif marker == MARKER_TRUE:
+            return True
+        elif marker == MARKER_FALSE:
+            return False
+        elif marker == MARKER_CHAR:
+            return chr(self._readBytes(1)[0])
+        elif marker == MARKER_HIGH_PRECISION:
+            text = self._readString()
+            try:
+                return int(text)
+            except ValueError:
+                return float(text)
+        else:
+            self.pos -= 1
+            self._error('unexpected marker %r' % chr(marker))
+
+    def _readContainerHeader(self):
+        '''Parse the optimized container header, if any, returning the type
+        and count markers.'''
+        type = None
+        count = None
+        marker = self._readMarker()
+        if marker == MARKER_TYPE:
+            type = self._readMarker()
+            marker = self._readMarker()
+            if marker != MARKER_COUNT:
+                self._error('expected count')
+        if marker == MARKER_COUNT:
+            count = self._readSize()
+            marker = None
+        return type, count, marker
+
+    def _readArray(self):
+        type, count, marker = self._readContainerHeader()
+
+        if type == MARKER_UINT8:
+            # Binary blob
+            return self._readBytes(count)
+
+        array = []
+        if count is None:
+            while marker != MARKER_ARRAY_END:
+                array.append(self.readValue(marker))
+                marker = self._readMarker()
+        else:
+            for i in range(count):
+                array.append(self.readValue(type))
+        return array
+
+    def _readObject(self):
+        type, count, marker = self._readContainerHeader()
+
+        obj = {}
+        i = 0
+        while True:
+            if count is None:
+                if marker == MARKER_OBJECT_END:
+                    break
+                name = self._readString(marker)
+                marker = None
+            else:
+                if i == count:
+                    break
+                i += 1
+                name = self._readString()
+            obj[name] = self.readValue(type)
+            if count is None:
+                marker = self._readMarker()
+
+        if self.strip_images:
+            if '__class__' in obj:
+                return None
+            for name in list(obj.keys()):
+                if name.startswith('__') and name.endswith('__'):
+                    del obj[name]
+
+        return obj
+
+    def load(self):
+        '''Decode the next document.'''
+        return self.readValue()
+
+    def loadAll(self):
+        '''Decode consecutive documents, until the end of the data.'''
+        while self.pos < len(self.data):
+            yield self.readValue()
+
+
+def loads(data, strip_images = True):
+    return Decoder(data, strip_images).load()
+
+
+def load(stream, strip_images = True):
+    return loads(stream.read(), strip_images)
+
+
+def load_all(stream, strip_images = True):
+    '''Decode consecutive documents, such as the states dumped by retrace for
+    a call set.'''
+    return Decoder(stream.read(), strip_images).loadAll()
@@ -30,12 +30,27 @@ Run as:
 
    apitrace pickle foo.trace | python unpickle.py
 
+or, to defer decoding of call arguments until they are actually used:
+
+   apitrace pickle --lazy-args foo.trace | python unpickle.py
+
+or, to analyze the columnar call table with NumPy:
+
+   apitrace pickle --columns=foo foo.trace > /dev/null
+   python unpickle.py --columns=foo
+
 '''
 
 
+import hashlib
+import io
 import itertools
+import json
+import mmap
 import operator
 import optparse
+import os
+import subprocess
 import sys
 import time
 import re
@@ -56,6 +71,11 @@ CALL_FLAG_MARKER_PUSH       = (1 << 9)
 CALL_FLAG_MARKER_POP        = (1 << 10)
 
 
+# Size of the reads issued on the pickle stream, so that many calls are
+# decoded per system call.
+BUFFER_SIZE = 1 << 20
+
+
 class Pointer(int):
 
     def __str__(self):
@@ -200,10 +220,30 @@ class Rebuilder(Visitor):
 
 class Call:
 
+    __slots__ = ('no', 'functionName', '_args', 'ret', 'flags', 'digest', '_hash')
+
     def __init__(self, callTuple):
-        self.no, self.functionName, self.args, self.ret, self.flags = callTuple
+        self.no, self.functionName, self._args, self.ret, self.flags = callTuple[:5]
+        # 64-bit structural hash, precomputed by `apitrace pickle --hash`
+        if len(callTuple) > 5:
+            self.digest = callTuple[5]
+        else:
+            self.digest = None
         self._hash = None
 
+    def _getArgs(self):
+        args = self._args
+        if isinstance(args, bytes):
+            # Arguments pickled with `apitrace pickle --lazy-args`
+            args = pickle.loads(args)
+            self._args = args
+        return args
+
+    def _setArgs(self, args):
+        self._args = args
+
+    args = property(_getArgs, _setArgs)
+
     def __str__(self):
         s = self.functionName
         if self.no is not None:
@@ -216,6 +256,10 @@ class Call:
         return s
 
     def __eq__(self, other):
+        # Calls are hashed by digest when they have one, so calls with and
+        # without digests must never compare equal, as their hashes differ
+        if self.digest is not None or other.digest is not None:
+            return self.digest == other.digest
         return \
             self.functionName == other.functionName and \
             self.args == other.args and \
@@ -223,9 +267,12 @@ class Call:
 
     def __hash__(self):
         if self._hash is None:
-            hasher = Hasher()
-            hashable = hasher.visit(self.functionName), hasher.visit(self.args), hasher.visit(self.ret)
-            self._hash = hash(hashable)
+            if self.digest is not None:
+                self._hash = hash(self.digest)
+            else:
+                hasher = Hasher()
+                hashable = hasher.visit(self.functionName), hasher.visit(self.args), hasher.visit(self.ret)
+                self._hash = hash(hashable)
         return self._hash
 
     def arg(self, argName):
@@ -240,35 +287,258 @@ class Call:
         return [value for name, value in self.args]
 
 
+def failed(ret):
+    '''Whether a call's HRESULT return value, symbolic or not, indicates
+    failure.'''
+    if isinstance(ret, str):
+        return ret.startswith(('E_', 'D3DERR_')) or '_E_' in ret or '_ERROR_' in ret
+    if isinstance(ret, int):
+        return ret < 0 or ret >= 0x80000000
+    return False
+
+
+def openStream(stream, bufferSize = BUFFER_SIZE):
+    '''Wrap a binary stream so that reads are done in large chunks.'''
+
+    try:
+        fileno = stream.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        return stream
+    return io.open(fileno, 'rb', buffering=bufferSize, closefd=False)
+
+
+class TraceCache:
+    '''Persistent on-disk cache of `apitrace pickle` output.
+
+    Entries are keyed by the trace path, modification time and size, and by
+    the pickle options (including the call set), and are memory-mapped when
+    read back.  The least recently used entries are evicted once the total
+    size exceeds the budget.
+    '''
+
+    def __init__(self, directory, budget = 4 << 30):
+        self.directory = directory
+        self.budget = budget
+
+    def path(self, trace, pickleArgs):
+        st = os.stat(trace)
+        key = repr((os.path.abspath(trace), st.st_mtime_ns, st.st_size, list(pickleArgs)))
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest + '.pickle')
+
+    def open(self, apitrace, trace, pickleArgs = ()):
+        '''Return the cached pickle output as a binary buffer, filling the
+        cache as needed, or None if the entry got evicted before it could be
+        read.'''
+
+        path = self.path(trace, pickleArgs)
+        try:
+            # Mark as most recently used
+            os.utime(path)
+            return self.read(path)
+        except OSError:
+            # Missing, or concurrently evicted between the two calls above
+            pass
+
+        self.fill(apitrace, trace, pickleArgs, path)
+        try:
+            stream = self.read(path)
+        except OSError:
+            # Evicted by another process already
+            stream = None
+        self.evict()
+        return stream
+
+    def read(self, path):
+        with open(path, 'rb') as stream:
+            if os.fstat(stream.fileno()).st_size == 0:
+                return io.BytesIO()
+            return mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def fill(self, apitrace, trace, pickleArgs, path):
+        os.makedirs(self.directory, exist_ok=True)
+        tmpPath = '%s.%u.tmp' % (path, os.getpid())
+        with open(tmpPath, 'wb') as stream:
+            returncode = subprocess.call([apitrace, 'pickle'] + list(pickleArgs) + [trace], stdout=stream)
+        if returncode != 0:
+            os.remove(tmpPath)
+            sys.stderr.write('error: apitrace pickle failed with exit code %i\n' % returncode)
+            sys.exit(1)
+        os.replace(tmpPath, path)
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pickle'):
+                path = os.path.join(self.directory, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    # Concurrently evicted
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+
+        total = sum([size for mtime, size, path in entries])
+        # Never evict the most recent entry
+        for mtime, size, path in entries[:-1]:
+            if total <= self.budget:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+def addCacheOptions(optparser):
+    optparser.add_option(
+        '--cache-dir', metavar='DIR',
+        type='string', dest='cache_dir', default=None,
+        help='cache pickled traces in DIR')
+    optparser.add_option(
+        '--cache-size', metavar='MB',
+        type='int', dest='cache_size', default=4096,
+        help='maximum size of the pickled trace cache [default: %default]')
+
+
+def getCache(options):
+    if options.cache_dir is None:
+        return None
+    return TraceCache(options.cache_dir, options.cache_size << 20)
+
+
+def openTrace(apitrace, trace, pickleArgs = (), cache = None):
+    '''Return a binary stream with the `apitrace pickle` output of trace.'''
+
+    if cache is not None:
+        stream = cache.open(apitrace, trace, pickleArgs)
+        if stream is not None:
+            return stream
+
+    p = subprocess.Popen(
+        args = [apitrace, 'pickle'] + list(pickleArgs) + [trace],
+        stdout = subprocess.PIPE,
+        bufsize = BUFFER_SIZE,
+    )
+    return p.stdout
+
+
 class Unpickler:
 
     callFactory = Call
 
     def __init__(self, stream):
         self.stream = stream
+        self.unpickler = None
 
     def parse(self):
-        while self.parseCall():
-            pass
+        for call in self.iterCalls():
+            try:
+                self.handleCall(call)
+            except StopIteration:
+                break
+
+    def iterCalls(self):
+        '''Generator yielding the decoded calls.'''
+
+        # A single unpickler is reused for all calls, which is much cheaper
+        # than invoking pickle.load for every call.
+        if self.unpickler is None:
+            self.unpickler = pickle.Unpickler(self.stream)
+        load = self.unpickler.load
+        callFactory = self.callFactory
+        while True:
+            try:
+                callTuple = load()
+            except EOFError:
+                return
+            yield callFactory(callTuple)
 
     def parseCall(self):
-        try:
-            callTuple = pickle.load(self.stream)
-        except EOFError:
-            return False
-        else:
-            call = self.callFactory(callTuple)
+        for call in self.iterCalls():
             try:
                 self.handleCall(call)
             except StopIteration:
                 return False
             else:
                 return True
+        return False
 
     def handleCall(self, call):
         pass
 
 
+def getFrameCallSets(apitrace, trace, numShards):
+    '''Split the trace into at most numShards call sets, spanning whole frames
+    and with roughly the same number of calls each.'''
+
+    output = subprocess.check_output([apitrace, 'info', '--dump-frames', trace])
+    info = json.loads(output)
+    frames = [frame for frame in info.get('Frames', []) if 'LastCallId' in frame]
+    totalCalls = sum([frame['TotalCalls'] for frame in frames])
+
+    callSets = []
+    start = 0
+    calls = 0
+    for frame in frames:
+        calls += frame['TotalCalls']
+        if len(callSets) + 1 < numShards and \
+           calls * numShards >= totalCalls * (len(callSets) + 1):
+            stop = frame['LastCallId']
+            callSets.append('%u-%u' % (start, stop))
+            start = stop + 1
+    # Last shard is open ended, to include calls after the last frame
+    callSets.append('%u-' % start)
+    return callSets
+
+
+def _parseShard(factory, apitrace, trace, callSet, pickleArgs, factoryArgs, cache):
+    stream = openTrace(apitrace, trace, list(pickleArgs) + ['--calls=' + callSet], cache)
+    parser = factory(stream, *factoryArgs)
+    # Bypass any reporting done by the subclass
+    Unpickler.parse(parser)
+    stream.close()
+
+    # Streams can't be sent back to the parent process
+    parser.stream = None
+    parser.unpickler = None
+    return parser
+
+
+def parseShards(factory, apitrace, trace, jobs, pickleArgs = (), factoryArgs = (), cache = None):
+    '''Parse the trace with a pool of jobs processes, each running its own
+    `apitrace pickle` over a range of frames, and merge the results in call
+    order.
+
+    factory is an Unpickler subclass, which is invoked as
+    factory(stream, *factoryArgs), and must implement a merge(other) method
+    folding the results of other, which parsed the calls immediately
+    following the ones parsed by self, into self.  merge must be associative,
+    so that the results can be combined in any grouping.
+    '''
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    if not callable(getattr(factory, 'merge', None)):
+        raise TypeError('%s does not support sharded parsing, as it has no merge method' % factory.__name__)
+
+    callSets = getFrameCallSets(apitrace, trace, jobs)
+    with ProcessPoolExecutor(jobs) as executor:
+        futures = [
+            executor.submit(_parseShard, factory, apitrace, trace, callSet, pickleArgs, factoryArgs, cache)
+            for callSet in callSets
+        ]
+        result = None
+        for future in futures:
+            parser = future.result()
+            if result is None:
+                result = parser
+            else:
+                result.merge(parser)
+    return result
+
+
 class Counter(Unpickler):
 
     def __init__(self, stream, verbose = False):
@@ -279,7 +549,9 @@ class Counter(Unpickler):
 
     def parse(self):
         Unpickler.parse(self)
+        self.report()
 
+    def report(self):
         functionFrequencies = list(self.functionFrequencies.items())
         functionFrequencies.sort(key=operator.itemgetter(1))
         for name, frequency in functionFrequencies:
@@ -295,10 +567,81 @@ class Counter(Unpickler):
         except KeyError:
             self.functionFrequencies[call.functionName] = 1
 
+    def merge(self, other):
+        self.numCalls += other.numCalls
+        for name, frequency in other.functionFrequencies.items():
+            self.functionFrequencies[name] = self.functionFrequencies.get(name, 0) + frequency
+
+
+class CallTable:
+    '''Columnar call table, as written by `apitrace pickle --columns=PREFIX`.
+
+    Columns are exposed as NumPy arrays, indexed by position in the table.
+    '''
+
+    def __init__(self, prefix):
+        import numpy
+
+        self.no = numpy.fromfile(prefix + '.no', dtype='<u4')
+        self.sig = numpy.fromfile(prefix + '.sig', dtype='<u4')
+        self.flags = numpy.fromfile(prefix + '.flags', dtype='<u4')
+        self.thread = numpy.fromfile(prefix + '.thread', dtype='<u4')
+        self.offsets = numpy.fromfile(prefix + '.offsets', dtype='<u8')
+        assert len(self.offsets) == len(self.no) + 1
+
+        with open(prefix + '.functions', 'rt') as stream:
+            self.functionNames = stream.read().splitlines()
+
+        self.argsPath = prefix + '.args'
+        self._argsData = None
+
+    def __len__(self):
+        return len(self.no)
+
+    def functionName(self, index):
+        return self.functionNames[self.sig[index]]
+
+    def args(self, index):
+        '''Decode the arguments of the call at the given index.'''
+        if self._argsData is None:
+            with open(self.argsPath, 'rb') as stream:
+                self._argsData = stream.read()
+        start = int(self.offsets[index])
+        end = int(self.offsets[index + 1])
+        return pickle.loads(self._argsData[start:end])
+
+    def mask(self, flags):
+        '''Boolean mask of the calls with any of the given flags set.'''
+        return (self.flags & flags) != 0
+
+    def frames(self):
+        '''Frame number of every call.'''
+        import numpy
+        endFrame = self.mask(CALL_FLAG_END_FRAME)
+        # The end-of-frame call belongs to the frame it ends
+        frames = numpy.cumsum(endFrame, dtype=numpy.uint32)
+        frames -= endFrame
+        return frames
+
+    def functionFrequencies(self, mask=None):
+        '''Return a {functionName: count} dictionary.'''
+        import numpy
+        sig = self.sig if mask is None else self.sig[mask]
+        counts = numpy.bincount(sig, minlength=len(self.functionNames))
+        return dict((self.functionNames[i], int(counts[i])) for i in numpy.flatnonzero(counts))
+
+    def frameCallCounts(self, mask=None):
+        '''Return an array with the number of calls in every frame.'''
+        import numpy
+        frames = self.frames()
+        if mask is not None:
+            frames = frames[mask]
+        return numpy.bincount(frames)
+
 
 def main():
     optparser = optparse.OptionParser(
-        usage="\n\tapitrace pickle <trace> | %prog [options]")
+        usage="\n\tapitrace pickle <trace> | %prog [options]\n\t%prog [options] <trace>")
     optparser.add_option(
         '-p', '--profile',
         action="store_true", dest="profile", default=False,
@@ -307,23 +650,69 @@ def main():
         '-v', '--verbose',
         action="store_true", dest="verbose", default=False,
         help="dump calls to stdout")
+    optparser.add_option(
+        '-c', '--columns', metavar='PREFIX',
+        type="string", dest="columns", default=None,
+        help="read columnar call table from PREFIX.* instead of stdin")
+    optparser.add_option(
+        '-a', '--apitrace', metavar='PROGRAM',
+        type='string', dest='apitrace', default='apitrace',
+        help='apitrace command [default: %default]')
+    optparser.add_option(
+        '-j', '--jobs', metavar='JOBS',
+        type="int", dest="jobs", default=None,
+        help="pickle the given trace in JOBS parallel frame ranges")
+    addCacheOptions(optparser)
 
     (options, args) = optparser.parse_args(sys.argv[1:])
 
-    if args:
+    cache = getCache(options)
+
+    if options.jobs is not None:
+        if len(args) != 1:
+            optparser.error('incorrect number of arguments')
+        if options.verbose:
+            optparser.error('--verbose is not supported with --jobs')
+
+        startTime = time.time()
+        parser = parseShards(Counter, options.apitrace, args[0], options.jobs, ['--lazy-args'], cache=cache)
+        parser.report()
+        stopTime = time.time()
+        duration = stopTime - startTime
+        if options.profile:
+            sys.stderr.write('Processed %u calls in %.03f secs, at %u calls/sec\n' % (parser.numCalls, duration, parser.numCalls/duration))
+        return
+
+    if len(args) > 1:
         optparser.error('unexpected arguments')
 
-    # Change stdin to binary mode
-    try:
-        import msvcrt
-    except ImportError:
-        pass
+    if options.columns is not None:
+        startTime = time.time()
+        table = CallTable(options.columns)
+        functionFrequencies = list(table.functionFrequencies().items())
+        functionFrequencies.sort(key=operator.itemgetter(1))
+        for name, frequency in functionFrequencies:
+            sys.stdout.write('%8u %s\n' % (frequency, name))
+        stopTime = time.time()
+        duration = stopTime - startTime
+        if options.profile:
+            sys.stderr.write('Processed %u calls in %.03f secs, at %u calls/sec\n' % (len(table), duration, len(table)/duration))
+        return
+
+    if args:
+        stream = openTrace(options.apitrace, args[0], ['--lazy-args'], cache)
     else:
-        import os
-        msvcrt.setmode(sys.stdin.fileno(), os.O_BINARY)
+        # Change stdin to binary mode
+        try:
+            import msvcrt
+        except ImportError:
+            pass
+        else:
+            msvcrt.setmode(sys.stdin.fileno(), os.O_BINARY)
+        stream = openStream(sys.stdin.buffer)
 
     startTime = time.time()
-    parser = Counter(sys.stdin.buffer, options.verbose)
+    parser = Counter(stream, options.verbose)
     parser.parse()
     stopTime = time.time()
     duration = stopTime - startTime
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+##########################################################################
+#
+# Copyright 2026 The apitrace authors
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+##########################################################################/
+
+
+'''Benchmark the code generators, and check their output for changes.
+
+Every generator of specs/generate.py is run, and the time spent in each of
+its stages (Tracer.traceApi, Retracer.retraceApi, Dispatcher.dispatchModule,
+and the state dumpers' dump) is recorded per API, together with the size and
+digest of the generated sources.  The digests are checked against the ones
+of the sources generated by the build, in specs/generated.sha256, so that
+optimizations of the generators can be checked to leave the generated code
+unchanged.  The results can be saved, and the times of later runs compared
+against them.
+'''
+
+
+import builtins
+import hashlib
+import json
+import multiprocessing
+import optparse
+import os.path
+import shutil
+import sys
+import tempfile
+import time
+
+
+_rootDir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Generators are imported as scripts, so make sure the specs directory itself
+# isn't in the path
+if sys.path and os.path.abspath(sys.path[0]) == os.path.dirname(os.path.abspath(__file__)):
+    sys.path[0] = _rootDir
+else:
+    sys.path.insert(0, _rootDir)
+
+from specs import generate
+
+
+# Digests of the sources generated by the build, with the default variables
+digestsPath = os.path.join(_rootDir, 'specs', 'generated.sha256')
+
+
+# Methods timed, as (stage, suffix of the class names they're timed in);
+# methods of the same stage nested in one another are only timed once
+_stages = {
+    'traceApi': ('trace', None),
+    'retraceApi': ('retrace', None),
+    'dispatchModule': ('dispatch', None),
+    'dispatchModuleDecl': ('dispatch', None),
+    'dispatchModuleImpl': ('dispatch', None),
+    'dump': ('dump', 'Dumper'),
+}
+
+
+def _getName(this, args):
+    '''Name of the API or module a stage is given, or else of the generator
+    class.'''
+    name = None
+    if args:
+        name = getattr(args[0], 'name', None)
+        if name is None and hasattr(args[0], 'modules'):
+            name = '+'.join([module.name for module in args[0].modules if module.name])
+    return name or this.__class__.__name__
+
+
+class StageTimer:
+    '''Wraps the stage methods of every class created, timing their
+    outermost invocations.'''
+
+    def __init__(self, buildClass):
+        self._buildClass = buildClass
+        self.depths = {}
+        self.times = {}
+
+    def buildClass(self, func, name, *bases, **kwds):
+        cls = self._buildClass(func, name, *bases, **kwds)
+        for attr, (stage, suffix) in _stages.items():
+            method = vars(cls).get(attr)
+            if callable(method) and (suffix is None or name.endswith(suffix)):
+                setattr(cls, attr, self.wrap(stage, method))
+        return cls
+
+    def wrap(self, stage, method):
+        def wrapper(this, *args, **kwargs):
+            depth = self.depths.get(stage, 0)
+            self.depths[stage] = depth + 1
+            startTime = time.perf_counter()
+            try:
+                return method(this, *args, **kwargs)
+            finally:
+                self.depths[stage] = depth
+                if depth == 0:
+                    key = '%s(%s)' % (method.__name__, _getName(this, args))
+                    self.times[key] = self.times.get(key, 0.0) + time.perf_counter() - startTime
+        wrapper.__name__ = method.__name__
+        wrapper.__doc__ = method.__doc__
+        return wrapper
+
+
+def benchmarkJob(job, outputDir):
+    '''Run a generator in the current process, which must be a fresh worker.
+
+    Returns the job and a dictionary with the total and per stage times, and
+    the sizes and digests of the outputs.'''
+
+    timer = StageTimer(builtins.__build_class__)
+    builtins.__build_class__ = timer.buildClass
+    try:
+        job, changed, seconds = generate.runJob(job, outputDir)
+    finally:
+        builtins.__build_class__ = timer._buildClass
+
+    sizes = {}
+    digests = {}
+    for output in job.outputs:
+        with open(os.path.join(outputDir, output), 'rb') as stream:
+            data = stream.read()
+        # Generators write text, so the newlines depend on the platform
+        data = data.replace(b'\r\n', b'\n')
+        sizes[output] = len(data)
+        digests[output] = hashlib.sha256(data).hexdigest()
+
+    return job, {
+        'seconds': seconds,
+        'stages': timer.times,
+        'sizes': sizes,
+        'digests': digests,
+    }
+
+
+def _benchmarkJob(args):
+    try:
+        return benchmarkJob(*args)
+    except BaseException:
+        import traceback
+        raise Exception('%s failed:\n%s' % (args[0].script, traceback.format_exc()))
+
+
+def _merge(result, sample):
+    '''Merge a repeated sample into result, keeping the fastest times.'''
+    if result is None:
+        return sample
+    result['seconds'] = min(result['seconds'], sample['seconds'])
+    for key, seconds in sample['stages'].items():
+        result['stages'][key] = min(result['stages'].get(key, seconds), seconds)
+    if sample['digests'] != result['digests']:
+        result['unstable'] = True
+    return result
+
+
+def benchmark(jobs, outputDir, numJobs = 1, repeat = 1, verbose = False):
+    '''Run every job repeat times.
+
+    Returns a dictionary with the results of every job, keyed by its first
+    output.'''
+
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+    pool = context.Pool(numJobs, maxtasksperchild=1)
+    results = {}
+    try:
+        for job, sample in pool.imap(_benchmarkJob, [(job, outputDir) for job in jobs for i in range(repeat)]):
+            if verbose:
+                sys.stderr.write('%-24s %6.2fs\n' % (job, sample['seconds']))
+            key = job.outputs[0]
+            results[key] = _merge(results.get(key), sample)
+    except Exception as ex:
+        sys.stderr.write('error: %s\n' % ex)
+        sys.exit(1)
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return {
+        'python': '%u.%u' % sys.version_info[:2],
+        'jobs': results,
+    }
+
+
+def readDigests(path = digestsPath):
+    '''Read the output digests from a file in sha256sum format.'''
+    digests = {}
+    with open(path, 'rt') as stream:
+        for line in stream:
+            if line.strip():
+                digest, output = line.split()
+                digests[output] = digest
+    return digests
+
+
+def writeDigests(digests, path = digestsPath):
+    '''Write the output digests to a file in sha256sum format.'''
+    with open(path, 'wt', newline='\n') as stream:
+        for output in sorted(digests):
+            stream.write('%s  %s\n' % (digests[output], output))
+
+
+def _delta(seconds, baseSeconds):
+    if baseSeconds is None:
+        return ''
+    if baseSeconds <= 0.0:
+        return '%9.3f' % baseSeconds
+    return '%9.3f %+6.1f%%' % (baseSeconds, (seconds - baseSeconds) * 100.0 / baseSeconds)
+
+
+def check(result, digests, base = None):
+    '''Check the outputs of a job against the given digests.
+
+    Returns a dictionary with the status of every output, which is 'same'
+    when the digests match.'''
+
+    statuses = {}
+    for output in result['digests']:
+        size = result['sizes'][output]
+        if result.get('unstable', False):
+            status = 'UNSTABLE'
+        elif output not in digests:
+            status = 'UNKNOWN'
+        elif digests[output] == result['digests'][output]:
+            status = 'same'
+        elif base and output in base['sizes']:
+            status = 'DIFFERENT (%+d bytes)' % (size - base['sizes'][output])
+        else:
+            status = 'DIFFERENT'
+        statuses[output] = status
+    return statuses
+
+
+def report(results, digests, baseline = None, stream = sys.stdout):
+    '''Print the results, against the baseline times if any.
+
+    Returns the outputs whose digests differ from the given ones, or are
+    unstable.'''
+
+    baseJobs = {}
+    if baseline is not None:
+        baseJobs = baseline['jobs']
+        stream.write('%-48s %9s %9s\n' % ('stage', 'seconds', 'baseline'))
+    else:
+        stream.write('%-48s %9s\n' % ('stage', 'seconds'))
+
+    def line(label, seconds, baseSeconds):
+        stream.write(('%-48s %9.3f %s' % (label, seconds, _delta(seconds, baseSeconds))).rstrip() + '\n')
+
+    totalSeconds = 0.0
+    totalBaseSeconds = 0.0
+    mismatches = []
+    for key in sorted(results['jobs']):
+        result = results['jobs'][key]
+        base = baseJobs.get(key)
+        line(key, result['seconds'], base['seconds'] if base else None)
+        for stage in sorted(result['stages']):
+            baseSeconds = base['stages'].get(stage) if base else None
+            line('  ' + stage, result['stages'][stage], baseSeconds)
+        totalSeconds += result['seconds']
+        if base:
+            totalBaseSeconds += base['seconds']
+
+        statuses = check(result, digests, base)
+        for output in sorted(statuses):
+            status = statuses[output]
+            stream.write('  %-46s %9u bytes %s\n' % (output, result['sizes'][output], status))
+            if status != 'same':
+                mismatches.append(output)
+
+    line('total', totalSeconds, totalBaseSeconds if baseline is not None else None)
+
+    return mismatches
+
+
+def main():
+    '''Main program.
+    '''
+
+    optparser = optparse.OptionParser(
+        usage='\n\t%prog [options] [OUTPUT ...]')
+    optparser.add_option(
+        '-j', '--jobs', metavar='JOBS',
+        type='int', dest='jobs', default=None,
+        help='number of generators to run in parallel [default: 1, or the number of CPUs with --check]')
+    optparser.add_option(
+        '-n', '--repeat', metavar='N',
+        type='int', dest='repeat', default=1,
+        help='run every generator N times, keeping the fastest [default: %default]')
+    optparser.add_option(
+        '-o', '--output', metavar='FILE',
+        type='string', dest='output', default=None,
+        help='save the results to FILE')
+    optparser.add_option(
+        '-b', '--baseline', metavar='FILE',
+        type='string', dest='baseline', default=None,
+        help='compare the times against the results saved in FILE')
+    optparser.add_option(
+        '-d', '--digests', metavar='FILE',
+        type='string', dest='digests', default=digestsPath,
+        help='check the outputs against the digests in FILE [default: specs/generated.sha256]')
+    optparser.add_option(
+        '-c', '--check',
+        action='store_true', dest='check', default=False,
+        help='only check the outputs against the digests, without reporting times')
+    optparser.add_option(
+        '-u', '--update',
+        action='store_true', dest='update', default=False,
+        help='update the digests FILE instead, after intended changes to the generated code')
+    optparser.add_option(
+        '-k', '--keep', metavar='DIR',
+        type='string', dest='keep', default=None,
+        help='keep the generated sources in DIR')
+    optparser.add_option(
+        '-v', '--verbose',
+        action='store_true', dest='verbose', default=False,
+        help='report progress')
+
+    options, args = optparser.parse_args(sys.argv[1:])
+
+    if options.repeat < 1:
+        optparser.error('invalid repeat count %d' % options.repeat)
+    if options.check and options.update:
+        optparser.error('--check and --update are mutually exclusive')
+    if options.jobs is None and not options.check:
+        options.jobs = 1
+
+    selected = generate.jobs
+    if args:
+        names = set(args)
+        selected = [job for job in generate.jobs if names.intersection(job.outputs)]
+        unknown = names.difference(*[job.outputs for job in generate.jobs])
+        if unknown:
+            optparser.error('unknown output(s): %s' % ', '.join(sorted(unknown)))
+
+    baseline = None
+    if options.baseline is not None:
+        with open(options.baseline, 'rt') as stream:
+            baseline = json.load(stream)
+
+    if options.keep is not None:
+        outputDir = options.keep
+        os.makedirs(outputDir, exist_ok=True)
+    else:
+        outputDir = tempfile.mkdtemp(prefix='apitrace-benchmark-')
+    try:
+        results = benchmark(selected, outputDir, options.jobs, options.repeat, options.verbose)
+    finally:
+        if options.keep is None:
+            shutil.rmtree(outputDir, ignore_errors=True)
+
+    try:
+        digests = readDigests(options.digests)
+    except FileNotFoundError:
+        if not options.update:
+            raise
+        digests = {}
+
+    if options.check:
+        mismatches = []
+        for key in sorted(results['jobs']):
+            statuses = check(results['jobs'][key], digests)
+            for output in sorted(statuses):
+                if statuses[output] != 'same':
+                    sys.stdout.write('%s: %s\n' % (output, statuses[output]))
+                    mismatches.append(output)
+    else:
+        mismatches = report(results, digests, baseline)
+
+    if options.output is not None:
+        with open(options.output, 'wt') as stream:
+            json.dump(results, stream, indent=2, sort_keys=True)
+            stream.write('\n')
+
+    unstable = [key for key, result in results['jobs'].items() if result.get('unstable', False)]
+    if options.update and not unstable:
+        for result in results['jobs'].values():
+            digests.update(result['digests'])
+        writeDigests(digests, options.digests)
+    elif unstable:
+        sys.stderr.write('error: generated code varies between runs: %s\n' % ', '.join(sorted(unstable)))
+        sys.exit(1)
+    elif mismatches:
+        sys.stderr.write('error: generated code differs from %s: %s\n' % (options.digests, ', '.join(mismatches)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+##########################################################################
+#
+# Copyright 2026 The apitrace authors
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+##########################################################################/
+
+
+'''Run the wrapper/retrace/dispatch code generators.
+
+The CMake scripts generate every source through this driver, e.g.
+
+    python3 specs/generate.py BINARY_DIR glxtrace.cpp
+
+and it can also write all sources to a directory at once.  Every generator
+runs in a fresh process with the same command line as when it's run by
+itself, so the generated sources, and the work needed to generate them, are
+the same either way.  Outputs are only rewritten when their contents change,
+so that build tools which check for that (Ninja) don't recompile unchanged
+sources.
+'''
+
+
+import multiprocessing
+import optparse
+import os.path
+import runpy
+import sys
+import time
+
+
+_rootDir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+class Job:
+    '''A generator invocation.
+
+    args may refer to the outputs as {0}, {1}, etc., and to the variables as
+    {NAME}.  When stdout is true the standard output is written to the first
+    output.
+    '''
+
+    def __init__(self, outputs, script, args = (), stdout = True):
+        self.outputs = outputs
+        self.script = script
+        self.args = args
+        self.stdout = stdout
+
+    def __str__(self):
+        return ' '.join(self.outputs)
+
+
+# Variables the CMake scripts set with -D, and their defaults
+variables = {
+    'HAVE_D3D8': '1',
+    'HAVE_D3D9': '1',
+}
+
+jobs = [
+    Job(['glproc.hpp', 'glproc.cpp'], 'dispatch/glproc.py', ['{0}', '{1}'], stdout = False),
+    Job(['glxtrace.cpp'], 'wrappers/glxtrace.py'),
+    Job(['egltrace.cpp'], 'wrappers/egltrace.py'),
+    Job(['wgltrace.cpp'], 'wrappers/wgltrace.py'),
+    Job(['cgltrace.cpp'], 'wrappers/cgltrace.py'),
+    Job(['ddrawtrace.cpp'], 'wrappers/ddrawtrace.py'),
+    Job(['d3d8trace.cpp'], 'wrappers/d3d8trace.py'),
+    Job(['d3d9trace.cpp'], 'wrappers/d3d9trace.py'),
+    Job(['dxgitrace.cpp'], 'wrappers/dxgitrace.py'),
+    Job(['d2d1trace.cpp'], 'wrappers/d2d1trace.py'),
+    Job(['glretrace_gl.cpp'], 'retrace/glretrace.py'),
+    Job(['glstate_params.cpp'], 'retrace/glstate_params.py'),
+    Job(['d3dretrace_ddraw.cpp'], 'retrace/ddrawretrace.py'),
+    Job(['d3dretrace_d3d8.cpp'], 'retrace/d3d9retrace.py', ['d3d8', '{HAVE_D3D8}']),
+    Job(['d3dretrace_d3d9.cpp'], 'retrace/d3d9retrace.py', ['d3d9', '{HAVE_D3D9}']),
+    Job(['d3dretrace_dxgi.cpp'], 'retrace/dxgiretrace.py'),
+    Job(['dxgistate_so.cpp'], 'retrace/dxgistate_so.py'),
+]
+
+
+def _replaceIfChanged(tmpPath, path, touch = False):
+    '''Rename tmpPath to path, unless path has the same contents, in which
+    case path is only touched if so requested.
+
+    Returns whether path was changed.'''
+    try:
+        with open(path, 'rb') as stream:
+            old = stream.read()
+    except FileNotFoundError:
+        pass
+    else:
+        with open(tmpPath, 'rb') as stream:
+            new = stream.read()
+        if new == old:
+            os.remove(tmpPath)
+            if touch:
+                os.utime(path)
+            return False
+    os.replace(tmpPath, path)
+    return True
+
+
+def runJob(job, outputDir, variables = variables, touch = False):
+    '''Run a generator in the current process, which must be a fresh one.
+
+    The specs can't be shared between generators, not even evaluated once
+    upfront, as spec modules extend shared types when imported (e.g.
+    winapi.HRESULT with the error codes of every DirectX module), so every
+    generator would then see all of them.
+
+    Returns a (job, changed outputs, seconds) tuple.'''
+
+    startTime = time.time()
+
+    script = os.path.join(_rootDir, job.script)
+    paths = [os.path.join(outputDir, output) for output in job.outputs]
+    tmpPaths = ['%s.%u.tmp' % (path, os.getpid()) for path in paths]
+
+    sys.argv = [script] + [arg.format(*tmpPaths, **variables) for arg in job.args]
+    sys.path[0] = os.path.dirname(script)
+
+    stdout = sys.stdout
+    if job.stdout:
+        sys.stdout = open(tmpPaths[0], 'wt')
+    try:
+        try:
+            runpy.run_path(script, run_name='__main__')
+        except SystemExit as ex:
+            if ex.code:
+                raise Exception('%s exited with %s' % (job.script, ex.code))
+        finally:
+            if sys.stdout is not stdout:
+                sys.stdout.close()
+                sys.stdout = stdout
+    except BaseException:
+        for tmpPath in tmpPaths:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+        raise
+
+    changed = [output for output, path, tmpPath in zip(job.outputs, paths, tmpPaths)
+               if _replaceIfChanged(tmpPath, path, touch)]
+
+    return job, changed, time.time() - startTime
+
+
+def _runJob(args):
+    try:
+        return runJob(*args)
+    except BaseException:
+        import traceback
+        raise Exception('%s failed:\n%s' % (args[0].script, traceback.format_exc()))
+
+
+def generate(jobs, outputDir, numJobs = None, variables = variables, touch = False, verbose = False):
+    '''Run the given jobs, in a pool of numJobs processes.'''
+
+    startTime = time.time()
+
+    os.makedirs(outputDir, exist_ok=True)
+
+    tasks = [(job, outputDir, variables, touch) for job in jobs]
+    try:
+        if len(tasks) == 1:
+            # This process hasn't loaded any specs yet
+            results = [_runJob(tasks[0])]
+            pool = None
+        else:
+            # Every worker runs a single job
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+            pool = context.Pool(numJobs, maxtasksperchild=1)
+            results = pool.imap_unordered(_runJob, tasks)
+        try:
+            for job, changed, seconds in results:
+                if verbose:
+                    sys.stderr.write('%-24s %6.2fs%s\n' % (job, seconds, '' if changed else ' (unchanged)'))
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+    except Exception as ex:
+        sys.stderr.write('error: %s\n' % ex)
+        sys.exit(1)
+
+    if verbose:
+        sys.stderr.write('total %.2fs\n' % (time.time() - startTime))
+
+
+def main():
+    '''Main program.
+    '''
+
+    optparser = optparse.OptionParser(
+        usage='\n\t%prog [options] OUTPUT_DIR [OUTPUT ...]')
+    optparser.add_option(
+        '-j', '--jobs', metavar='JOBS',
+        type='int', dest='jobs', default=None,
+        help='number of generators to run in parallel [default: number of CPUs]')
+    optparser.add_option(
+        '-D', '--define', metavar='NAME=VALUE',
+        action='append', type='string', dest='defines', default=[],
+        help='set a variable of the generator arguments')
+    optparser.add_option(
+        '--touch',
+        action='store_true', dest='touch', default=False,
+        help='touch unchanged outputs, for build tools which don\'t check whether outputs changed')
+    optparser.add_option(
+        '-l', '--list',
+        action='store_true', dest='list', default=False,
+        help='list the outputs and exit')
+    optparser.add_option(
+        '-v', '--verbose',
+        action='store_true', dest='verbose', default=False,
+        help='report the time taken by every generator')
+
+    options, args = optparser.parse_args(sys.argv[1:])
+
+    if options.list:
+        for job in jobs:
+            sys.stdout.write('%s\n' % job)
+        return
+
+    if not args:
+        optparser.error('incorrect number of arguments')
+
+    values = dict(variables)
+    for define in options.defines:
+        name, sep, value = define.partition('=')
+        if not sep or name not in variables:
+            optparser.error('invalid variable definition %r' % define)
+        values[name] = value
+
+    outputDir = args[0]
+    selected = jobs
+    if args[1:]:
+        names = set(args[1:])
+        selected = [job for job in jobs if names.intersection(job.outputs)]
+        unknown = names.difference(*[job.outputs for job in jobs])
+        if unknown:
+            optparser.error('unknown output(s): %s' % ', '.join(sorted(unknown)))
+
+    generate(selected, outputDir, options.jobs, values, options.touch, options.verbose)
+
+
+if __name__ == '__main__':
+    main()
@@ -956,6 +956,8 @@ class Module:
         self.headers = []
         self.functions = []
         self.interfaces = []
+        self._functionsByName = {}
+        self._numIndexedFunctions = 0
 
     def addFunctions(self, functions):
         self.functions.extend(functions)
@@ -969,10 +971,12 @@ class Module:
         self.interfaces.extend(module.interfaces)
 
     def getFunctionByName(self, name):
-        for function in self.functions:
-            if function.name == name:
-                return function
-        return None
+        # Functions are only ever appended, so index the new ones
+        if self._numIndexedFunctions != len(self.functions):
+            for function in self.functions[self._numIndexedFunctions:]:
+                self._functionsByName.setdefault(function.name, function)
+            self._numIndexedFunctions = len(self.functions)
+        return self._functionsByName.get(name)
 
 
 class API:
@@ -985,21 +989,39 @@ class API:
         self.modules = []
         if modules is not None:
             self.modules.extend(modules)
+        self._invalidate()
+
+    def _invalidate(self):
+        self._signature = None
+        self._types = None
+        self._interfaces = None
+        self._functionsByName = None
+
+    def _validate(self):
+        '''Drop the cached indexes if modules were added or grown since they
+        were built.'''
+        signature = [(id(module), len(module.functions), len(module.interfaces)) for module in self.modules]
+        if signature != self._signature:
+            self._invalidate()
+            self._signature = signature
 
     def getAllTypes(self):
-        collector = Collector()
-        for module in self.modules:
-            for function in module.functions:
-                for arg in function.args:
-                    collector.visit(arg.type)
-                collector.visit(function.type)
-            for interface in module.interfaces:
-                collector.visit(interface)
-                for method in interface.iterMethods():
-                    for arg in method.args:
+        self._validate()
+        if self._types is None:
+            collector = Collector()
+            for module in self.modules:
+                for function in module.functions:
+                    for arg in function.args:
                         collector.visit(arg.type)
-                    collector.visit(method.type)
-        return collector.types
+                    collector.visit(function.type)
+                for interface in module.interfaces:
+                    collector.visit(interface)
+                    for method in interface.iterMethods():
+                        for arg in method.args:
+                            collector.visit(arg.type)
+                        collector.visit(method.type)
+            self._types = collector.types
+        return list(self._types)
 
     def getAllFunctions(self):
         functions = []
@@ -1008,23 +1030,27 @@ class API:
         return functions
 
     def getAllInterfaces(self):
-        types = self.getAllTypes()
-        interfaces = [type for type in types if isinstance(type, Interface)]
-        for module in self.modules:
-            for interface in module.interfaces:
-                if interface not in interfaces:
-                    interfaces.append(interface)
-        return interfaces
+        self._validate()
+        if self._interfaces is None:
+            # Ordered set
+            interfaces = dict.fromkeys([type for type in self.getAllTypes() if isinstance(type, Interface)])
+            for module in self.modules:
+                interfaces.update(dict.fromkeys(module.interfaces))
+            self._interfaces = list(interfaces)
+        return list(self._interfaces)
 
     def addModule(self, module):
         self.modules.append(module)
+        self._invalidate()
 
     def getFunctionByName(self, name):
-        for module in self.modules:
-            for function in module.functions:
-                if function.name == name:
-                    return function
-        return None
+        self._validate()
+        if self._functionsByName is None:
+            self._functionsByName = {}
+            for module in self.modules:
+                for function in module.functions:
+                    self._functionsByName.setdefault(function.name, function)
+        return self._functionsByName.get(name)
 
 
 # C string (i.e., zero terminated)